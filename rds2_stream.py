@@ -1,16 +1,36 @@
 #!/usr/bin/env python3
+import binascii
+import bisect
+import csv
+import hashlib
+import io
+import json
 import math
+import os
+import platform
 import sys
 import time
 import queue
-from dataclasses import dataclass
-from typing import List, Optional, Tuple
+import socket
+import socketserver
+import struct
+import threading
+import tracemalloc
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, replace
+from fractions import Fraction
+from functools import lru_cache
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 import click
 import numpy as np
+import scipy
 import sounddevice as sd
 import soundfile as sf
-from scipy.signal import resample_poly, firwin, lfilter
+from scipy import fft as sp_fft
+from scipy.ndimage import minimum_filter1d
+from scipy.signal import bilinear, firwin, lfilter, upfirdn
 from PIL import Image
 
 
@@ -66,10 +86,16 @@ class RdsConfig:
     tp: int = 0
     program_service_name: str = ""
     radiotext: str = ""
+    # Programme type name (10A), alternative frequencies in MHz (0A), clock time (4A) and
+    # RadioText+ tags as (content type, start, length) into the RadioText (11A)
+    ptyn: str = ""
+    af: Tuple[float, ...] = ()
+    ct: bool = False
+    rt_plus: Tuple[Tuple[int, int, int], ...] = ()
 
 
-def _rds_crc10(word16: int) -> int:
-    """Compute 10-bit CRC checkword for a 16-bit block using RDS polynomial."""
+def _rds_crc10_bitwise(word16: int) -> int:
+    """Reference bit-serial 10-bit CRC checkword for a 16-bit block using RDS polynomial."""
     reg = 0
     data = word16 << 10
     mask = 1 << 25  # process 26 bits total
@@ -83,25 +109,58 @@ def _rds_crc10(word16: int) -> int:
     return reg & 0x3FF
 
 
-def _rds_block(word16: int, offset_word: int) -> Tuple[int, int]:
-    cw = _rds_crc10(word16) ^ offset_word
-    return word16 & 0xFFFF, cw & 0x3FF
+# The checkword is linear over GF(2), so crc(word) = crc(hi << 8) ^ crc(lo): two 256-entry tables
+_RDS_CRC_TABLE_HI = np.array([_rds_crc10_bitwise(b << 8) for b in range(256)], dtype=np.uint16)
+_RDS_CRC_TABLE_LO = np.array([_rds_crc10_bitwise(b) for b in range(256)], dtype=np.uint16)
+_RDS_OFFSETS = np.array([RDS_OFFSET_A, RDS_OFFSET_B, RDS_OFFSET_C, RDS_OFFSET_D], dtype=np.uint16)
+_RDS_BLOCK_SHIFTS = np.arange(25, -1, -1, dtype=np.uint32)
 
 
-def _pack_bits_from_blocks(blocks: List[Tuple[int, int]]) -> np.ndarray:
-    """Convert (word16, cw10) pairs into a flat bit array (MSB-first per word)."""
-    bits: List[int] = []
-    for word, cw in blocks:
-        for i in range(15, -1, -1):
-            bits.append((word >> i) & 1)
-        for i in range(9, -1, -1):
-            bits.append((cw >> i) & 1)
-    return np.array(bits, dtype=np.uint8)
+def rds_crc10(words: np.ndarray) -> np.ndarray:
+    """Table-driven 10-bit CRC checkwords for an array of 16-bit words."""
+    words = np.asarray(words, dtype=np.uint16)
+    return _RDS_CRC_TABLE_HI[words >> 8] ^ _RDS_CRC_TABLE_LO[words & 0xFF]
 
 
-def build_group_0a(cfg: RdsConfig, ps_pair_index: int) -> np.ndarray:
+def _rds_crc10(word16: int) -> int:
+    """Compute 10-bit CRC checkword for a 16-bit block using RDS polynomial."""
+    return int(_RDS_CRC_TABLE_HI[(word16 >> 8) & 0xFF] ^ _RDS_CRC_TABLE_LO[word16 & 0xFF])
+
+
+def encode_groups(words: np.ndarray) -> np.ndarray:
+    """Encode an (N, 4) array of block words (A, B, C, D) into (N, 104) bits, MSB-first per 26-bit block."""
+    words = np.asarray(words, dtype=np.uint16).reshape(-1, 4)
+    checkwords = rds_crc10(words) ^ _RDS_OFFSETS
+    blocks = (words.astype(np.uint32) << 10) | checkwords
+    bits = (blocks[:, :, None] >> _RDS_BLOCK_SHIFTS) & 1
+    return bits.astype(np.uint8).reshape(-1, 104)
+
+
+def _block_b(cfg: RdsConfig, group_type: int, low_bits: int, version_b: int = 0) -> int:
+    """Block B: group type (4 bits), version (0 = A), TP, PTY, then 5 bits that depend on the group."""
+    tp = 1 if cfg.tp else 0
+    return ((group_type & 0xF) << 12) | ((version_b & 1) << 11) | (tp << 10) | ((cfg.pty & 0x1F) << 5) | (low_bits & 0x1F)
+
+
+def af_codes(frequencies_mhz: Sequence[float]) -> List[int]:
+    """Block C words of group 0A for an AF list (method A): the count first, then two codes per word."""
+    if len(frequencies_mhz) > 25:
+        raise ValueError("at most 25 alternative frequencies")
+    codes = [224 + len(frequencies_mhz)]
+    for f in frequencies_mhz:
+        code = int(round((f - 87.5) * 10))
+        if not 1 <= code <= 204:
+            raise ValueError(f"alternative frequency {f} MHz is outside 87.6..108.0")
+        codes.append(code)
+    if len(codes) % 2:
+        codes.append(205)  # filler
+    return [(codes[i] << 8) | codes[i + 1] for i in range(0, len(codes), 2)]
+
+
+def group_0a_words(cfg: RdsConfig, ps_pair_index: int, af_word: int = 0) -> np.ndarray:
     """Group 0A: Basic tuning and switching information + PS name segments.
-    ps_pair_index: 0..3 selects which 2-char pair of the 8-char PS to send.
+    ps_pair_index: 0..3 selects which 2-char pair of the 8-char PS to send; af_word is block C
+    (one of af_codes(), or 0 without AF). Returns the four 16-bit block words; see encode_groups for the bits.
     """
     ps = (cfg.program_service_name or "").ljust(8)[:8]
     segment_ch = ps_pair_index & 0x3
@@ -110,41 +169,19 @@ def build_group_0a(cfg: RdsConfig, ps_pair_index: int) -> np.ndarray:
 
     # Block A: PI
     block_a = cfg.pi_code & 0xFFFF
-
-    # Block B: Group type 0A: type=0, version A(0), TP, PTY, and segment address
-    group_type = 0  # 0A
-    version_a = 0
-    tp = 1 if cfg.tp else 0
-    pty = cfg.pty & 0x1F
-    # Bits: 5-bit PTY, TP 1-bit, 4-bit group type+version, 5-bit segment/address
-    # Formal layout (MSB..LSB): TP(1), PTY(5), Type(4), TA(1), MS(1), DI(1), Segment(2) etc for 0A
-    # We'll follow common pack: 0AAAA BBBB includes various flags; keep TA=0, MS=0, DI=0
-    # Here we use a simplified and commonly accepted packing for 0A:
-    block_b = 0
-    block_b |= (tp & 1) << 10
-    block_b |= (pty & 0x1F) << 5
-    block_b |= (group_type & 0xF) << 1
-    block_b |= (version_a & 0x1)
-    # Set address for PS segment in Block B least significant 2 bits
-    block_b |= (segment_ch & 0x3)
-
-    # Block C: 0A carries no additional info; set 0
-    block_c = 0x0000
-
+    # Block B: TA=0, MS=0, DI=0 and the PS segment address
+    block_b = _block_b(cfg, 0, segment_ch)
+    # Block C: alternative frequencies
+    block_c = af_word & 0xFFFF
     # Block D: two characters of PS
     block_d = ((ord(c1) & 0xFF) << 8) | (ord(c2) & 0xFF)
 
-    blocks = [
-        _rds_block(block_a, RDS_OFFSET_A),
-        _rds_block(block_b, RDS_OFFSET_B),
-        _rds_block(block_c, RDS_OFFSET_C),
-        _rds_block(block_d, RDS_OFFSET_D),
-    ]
-    return _pack_bits_from_blocks(blocks)
+    return np.array([block_a, block_b, block_c, block_d], dtype=np.uint16)
 
 
-def build_group_2a(cfg: RdsConfig, rt_pair_index: int) -> np.ndarray:
-    """Group 2A: Radiotext, 64 chars in 2-char pairs across 16 blocks; rt_pair_index 0..15"""
+def group_2a_words(cfg: RdsConfig, rt_pair_index: int, ab_flag: int = 0) -> np.ndarray:
+    """Group 2A: Radiotext, 64 chars in 4-char segments across 16 groups; rt_pair_index 0..15.
+    ab_flag is the text A/B flag, flipped whenever the text changes."""
     text = (cfg.radiotext or "").ljust(64)[:64]
     pair_idx = rt_pair_index & 0x0F
     c1 = text[pair_idx * 4 + 0]
@@ -154,152 +191,689 @@ def build_group_2a(cfg: RdsConfig, rt_pair_index: int) -> np.ndarray:
 
     # A: PI
     block_a = cfg.pi_code & 0xFFFF
-
-    # B: Group type=2, version A(0)
-    group_type = 2
-    version_a = 0
-    tp = 1 if cfg.tp else 0
-    pty = cfg.pty & 0x1F
-    block_b = 0
-    block_b |= (tp & 1) << 10
-    block_b |= (pty & 0x1F) << 5
-    block_b |= (group_type & 0xF) << 1
-    block_b |= (version_a & 0x1)
-    # Radiotext A/B flag = 0, text segment address 4 bits
-    block_b |= (pair_idx & 0x0F)
-
+    # B: text A/B flag and 4-bit segment address
+    block_b = _block_b(cfg, 2, ((ab_flag & 1) << 4) | pair_idx)
     # C: two chars
     block_c = ((ord(c1) & 0xFF) << 8) | (ord(c2) & 0xFF)
     # D: two chars
     block_d = ((ord(c3) & 0xFF) << 8) | (ord(c4) & 0xFF)
 
-    blocks = [
-        _rds_block(block_a, RDS_OFFSET_A),
-        _rds_block(block_b, RDS_OFFSET_B),
-        _rds_block(block_c, RDS_OFFSET_C),
-        _rds_block(block_d, RDS_OFFSET_D),
-    ]
-    return _pack_bits_from_blocks(blocks)
+    return np.array([block_a, block_b, block_c, block_d], dtype=np.uint16)
+
+
+def group_3a_words(cfg: RdsConfig, app_group: Tuple[int, int], aid: int, message: int = 0) -> np.ndarray:
+    """Group 3A: announces an Open Data Application (aid) carried in app_group, e.g. (11, 0) for 11A."""
+    group_type, version_b = app_group
+    return np.array([cfg.pi_code & 0xFFFF, _block_b(cfg, 3, (group_type << 1) | version_b),
+                     message & 0xFFFF, aid & 0xFFFF], dtype=np.uint16)
+
+
+def group_4a_words(cfg: RdsConfig, timestamp: float) -> np.ndarray:
+    """Group 4A: clock time and date (UTC, local offset 0) at timestamp, seconds since the epoch."""
+    days, seconds = divmod(int(timestamp), 86400)
+    mjd = days + 40587  # the epoch is MJD 40587
+    hour, minute = seconds // 3600, (seconds // 60) % 60
+    return np.array([cfg.pi_code & 0xFFFF, _block_b(cfg, 4, (mjd >> 15) & 0x3),
+                     ((mjd & 0x7FFF) << 1) | (hour >> 4), ((hour & 0xF) << 12) | (minute << 6)], dtype=np.uint16)
+
+
+def group_10a_words(cfg: RdsConfig, segment: int, ab_flag: int = 0) -> np.ndarray:
+    """Group 10A: programme type name, 8 chars in two 4-char segments."""
+    name = (cfg.ptyn or "").ljust(8)[:8]
+    chars = [ord(c) & 0xFF for c in name[(segment & 1) * 4:(segment & 1) * 4 + 4]]
+    return np.array([cfg.pi_code & 0xFFFF, _block_b(cfg, 10, ((ab_flag & 1) << 4) | (segment & 1)),
+                     (chars[0] << 8) | chars[1], (chars[2] << 8) | chars[3]], dtype=np.uint16)
+
+
+# RadioText+ is an ODA (AID 0x4BD7) carried in group 11A and announced in 3A
+RT_PLUS_AID = 0x4BD7
+RT_PLUS_GROUP = (11, 0)
+
+
+def group_rt_plus_words(cfg: RdsConfig, item_toggle: int = 0, item_running: int = 1) -> np.ndarray:
+    """RadioText+ group (11A): up to two (content type, start, length) tags into the RadioText.
+    Tag 1 may be up to 64 characters long, tag 2 up to 32; a missing tag is sent as type 0."""
+    tags = list(cfg.rt_plus[:2]) + [(0, 0, 1)] * (2 - len(cfg.rt_plus[:2]))
+    (type1, start1, len1), (type2, start2, len2) = tags
+    if not (0 <= type1 < 64 and 0 <= start1 < 64 and 1 <= len1 <= 64
+            and 0 <= type2 < 64 and 0 <= start2 < 64 and 1 <= len2 <= 32):
+        raise ValueError("RT+ tags need type 0..63, start 0..63 and length 1..64 (1..32 for the second)")
+    block_b = _block_b(cfg, RT_PLUS_GROUP[0], ((item_toggle & 1) << 4) | ((item_running & 1) << 3) | (type1 >> 3),
+                       RT_PLUS_GROUP[1])
+    block_c = ((type1 & 0x7) << 13) | (start1 << 7) | ((len1 - 1) << 1) | (type2 >> 5)
+    block_d = ((type2 & 0x1F) << 11) | (start2 << 5) | (len2 - 1)
+    return np.array([cfg.pi_code & 0xFFFF, block_b, block_c, block_d], dtype=np.uint16)
+
+
+def check_rds_config(cfg: RdsConfig):
+    """Raise ValueError if the AF list or RT+ tags of cfg cannot be encoded."""
+    af_codes(cfg.af)
+    if len(cfg.rt_plus) > 2:
+        raise ValueError("RT+ carries at most two tags")
+    group_rt_plus_words(cfg)
+
+
+def build_group_0a(cfg: RdsConfig, ps_pair_index: int) -> np.ndarray:
+    return encode_groups(group_0a_words(cfg, ps_pair_index))[0]
+
+
+def build_group_2a(cfg: RdsConfig, rt_pair_index: int) -> np.ndarray:
+    return encode_groups(group_2a_words(cfg, rt_pair_index))[0]
+
+
+# =============================
+# RDS group scheduling
+# =============================
+
+# Groups per second on the RDS channel
+RDS_GROUP_RATE = RDS_BITRATE / 104
+# Minimum rate (groups/s) of each group type the generator can send. 3A/11A (RT+), 10A (PTYN)
+# and 4A (CT) only go out when the configuration has something for them to carry.
+DEFAULT_GROUP_RATES = {"0A": 4.0, "2A": 2.0, "3A": 0.1, "4A": 1 / 60, "10A": 0.5, "11A": 0.5}
+# Sent by the clock rather than the schedule table: 4A goes out as each minute starts, and its
+# rate only turns it off (0)
+_CLOCK_GROUPS = ("4A",)
+
+
+def parse_group_rates(spec: str) -> dict:
+    """Group rates from "0A=4,2A=2,4A=1/60" (groups per second; a rate of 0 stops the type)."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = item.partition("=")
+        name = name.strip().upper()
+        if name not in DEFAULT_GROUP_RATES:
+            raise ValueError(f"unknown group type {name!r}; known: {', '.join(DEFAULT_GROUP_RATES)}")
+        try:
+            rate = float(Fraction(value.strip()))
+        except (ValueError, ZeroDivisionError):
+            raise ValueError(f"bad rate for {name}: {value!r}")
+        if rate < 0:
+            raise ValueError(f"rate for {name} must not be negative")
+        rates[name] = rate
+    return rates
+
+
+def parse_rt_plus_tag(spec: str) -> Tuple[int, int, int]:
+    """A RadioText+ tag from "TYPE,START,LENGTH", e.g. "4,0,12" (4 = item artist)."""
+    try:
+        content_type, start, length = (int(part) for part in spec.split(","))
+    except ValueError:
+        raise ValueError(f"bad RT+ tag {spec!r}; expected TYPE,START,LENGTH")
+    return content_type, start, length
+
+
+def parse_af_list(spec: str) -> Tuple[float, ...]:
+    """Alternative frequencies from "98.1,101.3" (MHz)."""
+    try:
+        return tuple(float(part) for part in spec.split(",") if part.strip())
+    except ValueError:
+        raise ValueError(f"bad frequency list {spec!r}; expected MHz like 98.1,101.3")
+
+
+@lru_cache(maxsize=32)
+def group_schedule(rates: Tuple[Tuple[str, float], ...], cycle_seconds: float = 60.0) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """Weighted round-robin table for one cycle of groups: (types, table), table[i] indexing types.
+
+    rates is ((group type, groups per second), ...). Each type gets its rate's worth of the
+    cycle, at least one group. The channel is always full, so slots left over go to the types
+    in proportion to their rates; if the rates ask for more than the channel carries, the cycle
+    just gets longer and they all slow down in proportion.
+    Groups of each type are spread evenly through the cycle (smooth weighted round robin).
+    """
+    types = tuple(name for name, rate in rates if rate > 0)
+    if not types:
+        raise ValueError("no group type has a positive rate")
+    rate = np.array([r for _, r in rates if r > 0])
+    counts = np.maximum(1, np.round(rate * cycle_seconds)).astype(np.int64)
+    spare = int(round(cycle_seconds * RDS_GROUP_RATE)) - int(counts.sum())
+    if spare > 0:
+        # Largest remainder split of the spare slots
+        share = rate * spare / rate.sum()
+        extra = np.floor(share).astype(np.int64)
+        extra[np.argsort(extra - share, kind="stable")[:spare - int(extra.sum())]] += 1
+        counts += extra
+    total = int(counts.sum())
+    credit = np.zeros(len(types), dtype=np.int64)
+    table = np.empty(total, dtype=np.uint8)
+    for i in range(total):
+        credit += counts
+        pick = int(np.argmax(credit))
+        credit[pick] -= total
+        table[i] = pick
+    table.setflags(write=False)
+    return types, table
+
+
+def _carousel_key(cfg: RdsConfig) -> Tuple:
+    """Everything the group carousel depends on, normalized the way the group builders read it."""
+    return (
+        cfg.pi_code & 0xFFFF,
+        cfg.pty & 0x1F,
+        1 if cfg.tp else 0,
+        (cfg.program_service_name or "").ljust(8)[:8],
+        (cfg.radiotext or "").ljust(64)[:64],
+        (cfg.ptyn or "").ljust(8)[:8],
+        tuple(float(f) for f in cfg.af),
+        tuple(tuple(int(v) for v in tag) for tag in cfg.rt_plus[:2]),
+        bool(cfg.ct),
+    )
+
+
+# Key fields whose change flips a receiver-visible flag: RadioText (2A A/B and RT+ item toggle),
+# PTYN (10A A/B) and the RT+ tags (item toggle)
+_KEY_RT, _KEY_PTYN, _KEY_RT_PLUS = 4, 5, 7
 
 
 class RdsBitstreamGenerator:
-    """Generate a continuous RDS bitstream (0/1) by cycling groups 0A and 2A."""
+    """Generate a continuous RDS bitstream (0/1) from a weighted round-robin group schedule.
+
+    rates maps group types to groups per second (see DEFAULT_GROUP_RATES, which fills in the
+    types left out). 0A (PS, AF) and 2A (RadioText) always go out; 10A (PTYN), 3A/11A (RT+)
+    and 4A (CT) when the configuration sets ptyn, rt_plus or ct. The schedule table covers
+    cycle_seconds and is built once per rate set (group_schedule), so picking each next group is a table lookup and any
+    number of groups comes out as one batch; the same configuration gives the same bitstream.
+    4A is the exception: it is not in the table but goes out as clock() enters each new minute
+    (and straight away when CT is turned on), carrying that minute.
+
+    The encoded groups are precomputed once per configuration; when it changes (whether cfg is
+    reassigned or edited in place) only the groups whose words differ are re-encoded.
+    set_config()/update_config() may be called from any thread: the new configuration takes
+    effect at the next group boundary.
+    """
 
-    def __init__(self, cfg: RdsConfig):
+    def __init__(self, cfg: RdsConfig, rates: Optional[dict] = None, clock=time.time, cycle_seconds: float = 60.0):
         self.cfg = cfg
-        self.ps_index = 0
-        self.rt_index = 0
-        self.logo_frame: Optional[np.ndarray] = None
-        self.logo_idx = 0
-
-    def set_logo_bits(self, bits: Optional[np.ndarray]):
-        self.logo_frame = bits
-        self.logo_idx = 0
-
-    def _next_logo_chunk(self, max_bits: int) -> Optional[np.ndarray]:
-        if self.logo_frame is None or len(self.logo_frame) == 0:
-            return None
-        n = min(max_bits, len(self.logo_frame) - self.logo_idx)
-        if n <= 0:
-            # loop
-            self.logo_idx = 0
-            n = min(max_bits, len(self.logo_frame))
-        chunk = self.logo_frame[self.logo_idx:self.logo_idx + n]
-        self.logo_idx += n
-        return chunk
+        self.rates = dict(DEFAULT_GROUP_RATES, **(rates or {}))
+        self.clock = clock
+        self.cycle_seconds = cycle_seconds
+        self._next_cfg: Optional[RdsConfig] = None
+        self._cfg_lock = threading.Lock()
+        self._carousel_key: Optional[Tuple] = None
+        self._carousel_words = np.empty((0, 4), dtype=np.uint16)
+        self._carousel_bits = np.empty((0, 104), dtype=np.uint8)
+        # Carousel rows of each group type: name -> (first row, row count)
+        self._sections: dict = {}
+        self._schedule: Tuple[Tuple[str, ...], np.ndarray] = ((), np.empty(0, dtype=np.uint8))
+        self._slot = 0
+        self._flags = {"rt_ab": 0, "ptyn_ab": 0, "rt_plus_toggle": 0}
+        self._clock_minute: Optional[int] = None
+        self._clock_bits = np.empty(104, dtype=np.uint8)
+        # Minute of the last 4A sent, None to send one with the next group
+        self._ct_minute: Optional[int] = None
+        # Rest of a group that generate_bits split, sent first by the next call
+        self._pending_bits = np.empty(0, dtype=np.uint8)
+        # Groups started so far, by type; also where each type's rotation through its rows stands
+        self.group_counts = {"0A": 0, "2A": 0}
+        # Build the carousel and schedule now so a bad configuration or rate table fails here
+        self._carousel()
+
+    def _active_rates(self, cfg: RdsConfig) -> Tuple[Tuple[str, float], ...]:
+        """Rates of the table-scheduled group types cfg has something for."""
+        active = {"0A", "2A"}
+        if cfg.ptyn:
+            active.add("10A")
+        if cfg.rt_plus:
+            active.update(("3A", "11A"))
+        return tuple((name, float(rate)) for name, rate in self.rates.items() if name in active)
+
+    def _sends_clock(self) -> bool:
+        return bool(self.cfg.ct) and self.rates["4A"] > 0
+
+    def _group_words(self) -> dict:
+        cfg, flags = self.cfg, self._flags
+        af_words = af_codes(cfg.af) if cfg.af else [0]
+        ps_rows = 4 * len(af_words) // math.gcd(4, len(af_words))
+        words = {
+            "0A": [group_0a_words(cfg, i, af_words[i % len(af_words)]) for i in range(ps_rows)],
+            "2A": [group_2a_words(cfg, i, flags["rt_ab"]) for i in range(16)],
+        }
+        if cfg.ptyn:
+            words["10A"] = [group_10a_words(cfg, i, flags["ptyn_ab"]) for i in range(2)]
+        if cfg.rt_plus:
+            words["3A"] = [group_3a_words(cfg, RT_PLUS_GROUP, RT_PLUS_AID)]
+            words["11A"] = [group_rt_plus_words(cfg, flags["rt_plus_toggle"])]
+        return words
+
+    def _carousel(self) -> np.ndarray:
+        key = _carousel_key(self.cfg)
+        if key != self._carousel_key:
+            old = self._carousel_key
+            if old is not None:
+                if key[_KEY_RT] != old[_KEY_RT]:
+                    self._flags["rt_ab"] ^= 1
+                if key[_KEY_PTYN] != old[_KEY_PTYN]:
+                    self._flags["ptyn_ab"] ^= 1
+                if key[_KEY_RT] != old[_KEY_RT] or key[_KEY_RT_PLUS] != old[_KEY_RT_PLUS]:
+                    self._flags["rt_plus_toggle"] ^= 1
+            sections, rows = {}, []
+            for name, group_words in self._group_words().items():
+                sections[name] = (len(rows), len(group_words))
+                rows.extend(group_words)
+            words = np.stack(rows)
+            if words.shape == self._carousel_words.shape:
+                # Rows already handed out stay valid: patch a copy
+                changed = np.flatnonzero(np.any(words != self._carousel_words, axis=1))
+                bits = self._carousel_bits.copy()
+                bits[changed] = encode_groups(words[changed])
+            else:
+                bits = encode_groups(words)
+            bits.setflags(write=False)
+            self._carousel_bits = bits
+            self._carousel_words = words
+            self._carousel_key = key
+            self._sections = sections
+            self._clock_minute = None
+            schedule = group_schedule(self._active_rates(self.cfg), self.cycle_seconds)
+            if schedule is not self._schedule:
+                self._schedule, self._slot = schedule, 0
+        return self._carousel_bits
+
+    def set_config(self, cfg: RdsConfig):
+        """Switch to cfg (a copy is taken) at the next group boundary; the group on air finishes unchanged."""
+        group_schedule(self._active_rates(cfg), self.cycle_seconds)
+        with self._cfg_lock:
+            self._next_cfg = replace(cfg)
+
+    def update_config(self, **changes) -> RdsConfig:
+        """set_config with the given RdsConfig fields changed from the latest configuration; returns it."""
+        with self._cfg_lock:
+            cfg = replace(self._next_cfg or self.cfg, **changes)
+            group_schedule(self._active_rates(cfg), self.cycle_seconds)
+            self._next_cfg = cfg
+        return cfg
+
+    def latest_config(self) -> RdsConfig:
+        """The configuration on air, or the one waiting for the next group boundary if set."""
+        with self._cfg_lock:
+            return self._next_cfg or self.cfg
+
+    def _apply_next_config(self):
+        if self._next_cfg is not None:
+            with self._cfg_lock:
+                self.cfg, self._next_cfg = self._next_cfg, None
+
+    def cycle_groups(self) -> int:
+        """Groups from the start of the schedule until every group of the configuration has gone out once."""
+        self._apply_next_config()
+        self._carousel()
+        types, table = self._schedule
+        groups = 0
+        for index, name in enumerate(types):
+            at = np.flatnonzero(table == index)
+            cycles, nth = divmod(self._sections[name][1] - 1, len(at))
+            groups = max(groups, cycles * len(table) + int(at[nth]) + 1)
+        return groups
+
+    def _clock_group(self, minute: int) -> np.ndarray:
+        if minute != self._clock_minute:
+            self._clock_bits = encode_groups(group_4a_words(self.cfg, minute * 60))[0]
+            self._clock_minute = minute
+        return self._clock_bits
+
+    def _clock_slots(self, count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Positions among the next count groups where a new minute starts, and those minutes."""
+        if not self._sends_clock():
+            self._ct_minute = None
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.int64)
+        # Group i starts about i group periods from now
+        minutes = ((self.clock() + np.arange(count) / RDS_GROUP_RATE) // 60).astype(np.int64)
+        previous = np.empty_like(minutes)
+        previous[0] = -1 if self._ct_minute is None else self._ct_minute
+        previous[1:] = minutes[:-1]
+        at = np.flatnonzero(minutes != previous)
+        if len(at):
+            self._ct_minute = int(minutes[-1])
+        return at, minutes[at]
+
+    def _next_groups(self, count: int) -> np.ndarray:
+        """The next count groups (4A where a minute starts, the schedule's otherwise) as a (count, 104) bit array."""
+        carousel = self._carousel()
+        clock_at, clock_minutes = self._clock_slots(count)
+        scheduled = count - len(clock_at)
+        types, table = self._schedule
+        slots = table[(self._slot + np.arange(scheduled)) % len(table)]
+        self._slot = (self._slot + scheduled) % len(table)
+        rows = np.empty(scheduled, dtype=np.intp)
+        for index, name in enumerate(types):
+            at = np.flatnonzero(slots == index)
+            if not len(at):
+                continue
+            first, n = self._sections[name]
+            sent = self.group_counts.get(name, 0)
+            rows[at] = first + (sent + np.arange(len(at))) % n
+            self.group_counts[name] = sent + len(at)
+        if not len(clock_at):
+            return carousel[rows]
+        bits = np.empty((count, 104), dtype=np.uint8)
+        bits[np.setdiff1d(np.arange(count), clock_at, assume_unique=True)] = carousel[rows]
+        for at, minute in zip(clock_at, clock_minutes):
+            bits[at] = self._clock_group(int(minute))
+        self.group_counts["4A"] = self.group_counts.get("4A", 0) + len(clock_at)
+        return bits
 
     def next_group_bits(self) -> np.ndarray:
-        # Insert small logo chunk periodically to keep presence in RDS2 sidebands
-        if (self.ps_index % 5) == 0 and self.logo_frame is not None:
-            # Return a slice of logo bits directly, not an RDS group
-            chunk = self._next_logo_chunk(104)  # approx group size
-            if chunk is not None:
-                return chunk
-
-        # Alternate two 0A per one 2A group to keep PS fresh
-        if (self.ps_index % 3) != 2:
-            bits = build_group_0a(self.cfg, self.ps_index & 0x3)
-            self.ps_index = (self.ps_index + 1) % 4
-            return bits
-        else:
-            bits = build_group_2a(self.cfg, self.rt_index & 0x0F)
-            self.rt_index = (self.rt_index + 1) % 16
-            return bits
+        if len(self._pending_bits):
+            rest, self._pending_bits = self._pending_bits, self._pending_bits[:0]
+            return rest
+        self._apply_next_config()
+        return self._next_groups(1)[0]
 
     def generate_bits(self, total_bits: int) -> np.ndarray:
-        out = np.empty(total_bits, dtype=np.uint8)
-        filled = 0
-        while filled < total_bits:
-            group = self.next_group_bits()
-            n = min(len(group), total_bits - filled)
-            out[filled:filled + n] = group[:n]
-            filled += n
+        """Next total_bits of the stream. A group split at the end is finished by the next call,
+        so consecutive calls concatenate to one unbroken bitstream."""
+        carried = self._pending_bits[:total_bits]
+        self._pending_bits = self._pending_bits[len(carried):]
+        parts: List[np.ndarray] = [carried]
+        missing = total_bits - len(carried)
+        if missing > 0:
+            # Any split group is complete, so this is a group boundary
+            self._apply_next_config()
+            parts.append(self._next_groups(-(-missing // 104)).ravel())
+        bits = np.concatenate(parts)
+        self._pending_bits = np.concatenate([bits[total_bits:], self._pending_bits])
+        return bits[:total_bits]
+
+
+# =============================
+# RDS2 file carousel
+# =============================
+
+# Files on the RDS2 streams travel as groups of four 16-bit words, each block with its usual
+# RDS checkword. Word A addresses the group: slot (3 bits), toggle (1 bit, flips whenever the
+# slot's file is replaced) and segment address (12 bits). Segment 0 is the file header
+# (B, C = length in bytes, D = CRC-16/CCITT of the file); segments 1..N carry 6 bytes each in B-D.
+RDS2_FILE_SLOTS = 8
+RDS2_FILE_SEGMENT_BYTES = 6
+# Address 0xFFF is kept for the filler group sent when no file is loaded
+RDS2_FILE_MAX_SEGMENTS = 0xFFE
+RDS2_FILE_MAX_BYTES = RDS2_FILE_MAX_SEGMENTS * RDS2_FILE_SEGMENT_BYTES
+_RDS2_FILLER_BITS = encode_groups(np.array([0xFFFF, 0, 0, 0], dtype=np.uint16))[0]
+_RDS2_FILLER_BITS.setflags(write=False)
+
+
+def rds2_file_words(data: bytes, slot: int, toggle: int = 0) -> np.ndarray:
+    """Segment a file into carousel groups: an (N + 1, 4) array of words, header first."""
+    if not 0 <= slot < RDS2_FILE_SLOTS:
+        raise ValueError(f"slot must be 0..{RDS2_FILE_SLOTS - 1}")
+    if len(data) > RDS2_FILE_MAX_BYTES:
+        raise ValueError(f"file too large for the carousel ({len(data)} > {RDS2_FILE_MAX_BYTES} bytes)")
+    segments = -(-len(data) // RDS2_FILE_SEGMENT_BYTES)
+    padded = np.zeros(segments * RDS2_FILE_SEGMENT_BYTES, dtype=np.uint8)
+    padded[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    words = np.empty((segments + 1, 4), dtype=np.uint16)
+    words[:, 0] = (slot << 13) | ((toggle & 1) << 12) | np.arange(segments + 1)
+    words[0, 1:] = (len(data) >> 16, len(data) & 0xFFFF, binascii.crc_hqx(data, 0xFFFF))
+    words[1:, 1:] = padded.view(">u2").reshape(segments, 3)
+    return words
+
+
+class Rds2FileCarousel:
+    """Cycle a set of files over the RDS2 streams, each at its own share of the bandwidth.
+
+    A file is segmented and encoded once, when set (set_file); the carousel then only indexes
+    rows of the encoded groups. Slots take turns by smooth weighted round robin over their shares,
+    and each sends header, segment 1, ..., segment N, then starts over. Replacing or removing a
+    file, or changing a share, may be done from any thread and takes effect at the next group;
+    the other slots carry on where they were.
+
+    stream() returns a bit source for one RDS2 carrier (for MpxEngine's rds2_gens); all streams
+    of a carousel draw from the same sequence, so more carriers mean faster transfers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files: dict = {}
+        # Groups sent, by slot ("filler" counts groups sent with no file loaded)
+        self.group_counts: dict = {"filler": 0}
+
+    def set_file(self, slot: int, data: bytes, share: float = 1.0, name: str = "") -> dict:
+        """Load data into slot (replacing what is there) and return its index entry."""
+        if share <= 0:
+            raise ValueError("share must be positive")
+        # Encode outside the lock; if a concurrent replacement of the slot got in meanwhile,
+        # flip the toggle in word A again under the lock so every change still shows
+        with self._lock:
+            old = self._files.get(slot)
+        toggle = (old["toggle"] ^ 1) if old is not None else 0
+        words = rds2_file_words(data, slot, toggle)
+        bits = encode_groups(words)
+        with self._lock:
+            old = self._files.get(slot)
+            latest = (old["toggle"] ^ 1) if old is not None else 0
+            if latest != toggle:
+                toggle = latest
+                words[:, 0] ^= 1 << 12
+                bits = encode_groups(words)
+            bits.setflags(write=False)
+            entry = {"slot": slot, "name": name, "size": len(data), "segments": len(bits) - 1,
+                     "crc": binascii.crc_hqx(data, 0xFFFF), "share": float(share), "toggle": toggle,
+                     "cycles": 0, "_bits": bits, "_next": 0, "_credit": 0.0}
+            self._files[slot] = entry
+            self.group_counts.setdefault(str(slot), 0)
+        return self._public(entry)
+
+    def remove_file(self, slot: int):
+        with self._lock:
+            self._files.pop(slot, None)
+
+    def set_share(self, slot: int, share: float):
+        if share <= 0:
+            raise ValueError("share must be positive")
+        with self._lock:
+            if slot not in self._files:
+                raise ValueError(f"no file in slot {slot}")
+            self._files[slot]["share"] = float(share)
+
+    @staticmethod
+    def _public(entry: dict) -> dict:
+        return {k: v for k, v in entry.items() if not k.startswith("_")}
+
+    def index(self) -> List[dict]:
+        """One entry per loaded file: slot, name, size, segments, crc, share, toggle and cycles sent."""
+        with self._lock:
+            return [self._public(self._files[slot]) for slot in sorted(self._files)]
+
+    def next_groups(self, count: int) -> np.ndarray:
+        """The next count groups as a (count, 104) bit array."""
+        out = np.empty((count, 104), dtype=np.uint8)
+        counts = self.group_counts
+        with self._lock:
+            files = list(self._files.values())
+            total = sum(f["share"] for f in files)
+            for i in range(count):
+                if not files:
+                    out[i] = _RDS2_FILLER_BITS
+                    counts["filler"] += 1
+                    continue
+                # Smooth weighted round robin: evenly interleaved, exact shares over each round
+                for f in files:
+                    f["_credit"] += f["share"]
+                pick = max(files, key=lambda f: f["_credit"])
+                pick["_credit"] -= total
+                row = pick["_next"]
+                out[i] = pick["_bits"][row]
+                pick["_next"] = (row + 1) % len(pick["_bits"])
+                if pick["_next"] == 0:
+                    pick["cycles"] += 1
+                counts[str(pick["slot"])] += 1
         return out
 
+    def stream(self) -> "Rds2CarouselStream":
+        return Rds2CarouselStream(self)
+
+    def copy(self) -> "Rds2FileCarousel":
+        """A carousel with the same files and shares, starting from the top (the encoded groups are shared)."""
+        other = Rds2FileCarousel()
+        with self._lock:
+            for slot, entry in self._files.items():
+                other._files[slot] = dict(entry, cycles=0, _next=0, _credit=0.0)
+                other.group_counts[str(slot)] = 0
+        return other
+
+
+class Rds2CarouselStream:
+    """Bit source for one RDS2 carrier drawing whole groups from a shared Rds2FileCarousel."""
+
+    def __init__(self, carousel: Rds2FileCarousel):
+        self.carousel = carousel
+        # Rest of a group that generate_bits split, sent first by the next call
+        self._pending_bits = np.empty(0, dtype=np.uint8)
+
+    def generate_bits(self, total_bits: int) -> np.ndarray:
+        """Next total_bits of this stream; consecutive calls concatenate to one unbroken bitstream."""
+        carried = self._pending_bits[:total_bits]
+        self._pending_bits = self._pending_bits[len(carried):]
+        missing = total_bits - len(carried)
+        if missing <= 0:
+            return carried
+        bits = np.concatenate([carried, self.carousel.next_groups(-(-missing // 104)).ravel()])
+        self._pending_bits = bits[total_bits:]
+        return bits[:total_bits]
+
 
 # =============================
 # RDS BPSK waveform generation
 # =============================
 
 
-def differential_encode(bits: np.ndarray) -> np.ndarray:
-    """Differential encoding for RDS: 1 -> phase invert, 0 -> no change. Output +/-1."""
-    out = np.empty_like(bits, dtype=np.int8)
-    phase = 1
-    for i, b in enumerate(bits):
-        if b:
-            phase = -phase
-        out[i] = phase
-    return out.astype(np.float64)
+def differential_encode(bits: np.ndarray, phase: int = 1) -> np.ndarray:
+    """Differential encoding for RDS: 1 -> phase invert, 0 -> no change. Output +/-1.
+    phase is the symbol preceding bits[0], so consecutive blocks can be encoded independently.
+    """
+    flips = np.bitwise_xor.accumulate(np.asarray(bits) != 0)
+    return np.where(flips, -phase, phase).astype(np.float64)
+
 
+def _raised_cosine_at(t: np.ndarray, beta: float) -> np.ndarray:
+    """Raised cosine impulse response at t symbol periods from its centre (unit peak)."""
+    denom = 1 - (2 * beta * t) ** 2
+    singular = np.abs(denom) < 1e-8
+    h = np.sinc(t) * (np.cos(math.pi * beta * t) / np.where(singular, 1.0, denom))
+    # Special case to avoid division by zero
+    h[singular] = math.pi / 4 * np.sinc(1 / (2 * beta))
+    return h
 
+
+@lru_cache(maxsize=64)
 def raised_cosine(num_taps: int, beta: float, sps: float) -> np.ndarray:
-    """Raised cosine pulse shape filter (FIR) for BPSK shaping."""
+    """Raised cosine pulse shape filter (FIR) for BPSK shaping. Memoized; the result is read-only."""
     # Time vector centered
     t = (np.arange(num_taps) - (num_taps - 1) / 2.0) / sps
-    h = np.zeros_like(t)
-    for i, ti in enumerate(t):
-        if abs(1 - (2 * beta * ti) ** 2) < 1e-8:
-            # Special case to avoid division by zero
-            h[i] = math.pi / 4 * np.sinc(1 / (2 * beta))
-        else:
-            h[i] = np.sinc(ti) * (np.cos(math.pi * beta * ti) / (1 - (2 * beta * ti) ** 2))
+    h = _raised_cosine_at(t, beta)
     # Normalize energy
     h = h / np.sum(h)
+    h.setflags(write=False)
     return h
 
 
+# Cap on polyphase branches; rates whose symbol clock needs more phases snap to the nearest one
+MAX_PULSE_PHASES = 16384
+
+
+@lru_cache(maxsize=16)
+def polyphase_pulse_bank(sps: Fraction, beta: float = 0.5, span_symbols: int = 6) -> np.ndarray:
+    """Raised-cosine pulse sampled at every symbol-clock phase: bank[phase, tap].
+
+    Row p weights the span_symbols symbols around an output sample that falls p/P of a symbol after
+    a symbol instant, oldest symbol first. With sps = num/den every sample instant is a multiple of
+    1/num of a symbol, so P = num makes the bank exact; awkward ratios are capped at MAX_PULSE_PHASES.
+    """
+    phases = min(sps.numerator, MAX_PULSE_PHASES)
+    mu = np.arange(phases) / phases
+    t = mu[:, None] + (span_symbols // 2 - 1) - np.arange(span_symbols)
+    bank = _raised_cosine_at(t, beta)
+    bank.setflags(write=False)
+    return bank
+
+
+class PolyphaseBpskShaper:
+    """Streaming symbol-to-sample BPSK shaper for any fs / bitrate ratio.
+
+    A symbol-clock NCO (like SymbolPointer in libJMPX) tracks, in exact integer arithmetic, which
+    symbol and fractional phase every output sample falls on; the sample is then span_symbols
+    multiply-adds against the matching row of polyphase_pulse_bank. The cost per sample does not
+    depend on the ratio, and the output does not depend on how it is split into blocks.
+    """
+
+    def __init__(self, fs: float, bitrate: float = RDS_BITRATE, beta: float = 0.5, span_symbols: int = 6,
+                 dtype=np.float64):
+        sps = Fraction(fs) / Fraction(bitrate)
+        if sps < 4:
+            raise ValueError("Sampling rate too low for RDS/RDS2")
+        self.sps = sps
+        self.span = span_symbols
+        self.dtype = np.dtype(dtype)
+        self._bank = polyphase_pulse_bank(sps, beta, span_symbols).astype(self.dtype)
+        self.reset()
+
+    def reset(self):
+        self._n = 0
+        self._phase = 1
+        # Symbols before the stream starts are silent
+        self._symbols = np.zeros(self.span, dtype=self.dtype)
+        self._sym_base = -self.span
+
+    def push_symbols(self, symbols: np.ndarray):
+        self._symbols = np.concatenate([self._symbols, np.asarray(symbols, dtype=self.dtype)])
+
+    def push_bits(self, bits: np.ndarray):
+        """Differentially encode bits (continuing the previous phase) and queue them as symbols."""
+        if len(bits) == 0:
+            return
+        symbols = differential_encode(bits, self._phase)
+        self._phase = int(symbols[-1])
+        self.push_symbols(symbols)
+
+    def _clock(self, num_samples: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Symbol index and bank row for each of the next num_samples samples
+        num, den = self.sps.numerator, self.sps.denominator
+        phases = self._bank.shape[0]
+        x = (self._n + np.arange(num_samples, dtype=np.int64)) * den
+        k = x // num
+        if phases == num:
+            return k, x % num
+        row = ((x % num) * phases + num // 2) // num
+        return k + row // phases, row % phases
+
+    def symbols_needed(self, num_samples: int) -> int:
+        """How many more symbols must be pushed before read(num_samples) can run."""
+        num, den = self.sps.numerator, self.sps.denominator
+        last_k = ((self._n + num_samples - 1) * den + num // 2) // num + self.span // 2
+        return max(0, last_k + 1 - (self._sym_base + len(self._symbols)))
+
+    def read(self, num_samples: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Shape the next num_samples samples of baseband, into out if given."""
+        if out is None:
+            out = np.empty(num_samples, dtype=self.dtype)
+        if num_samples <= 0:
+            return out
+        if self.symbols_needed(num_samples) > 0:
+            raise ValueError("Not enough symbols queued for the requested samples")
+        k, row = self._clock(num_samples)
+        weights = self._bank[row]
+        first = k - (self.span // 2 - 1) - self._sym_base
+        np.multiply(weights[:, 0], self._symbols[first], out=out)
+        for j in range(1, self.span):
+            out += weights[:, j] * self._symbols[first + j]
+        self._n += num_samples
+        # Drop symbols no later sample can reach
+        drop = int(first[-1]) - self.span
+        if drop > 0:
+            self._symbols = self._symbols[drop:]
+            self._sym_base += drop
+        return out
+
+
 def bpsk_subcarrier(bits: np.ndarray, fs: float, subcarrier_hz: float, bitrate: float = RDS_BITRATE,
                     beta: float = 0.5, span_symbols: int = 6) -> np.ndarray:
     """Generate BPSK with differential encoding and raised-cosine shaping, mixed to subcarrier."""
-    sps = fs / bitrate
-    if sps < 4:
-        raise ValueError("Sampling rate too low for RDS/RDS2")
-    # Differential encoding to +/-1 symbols
-    symbols = differential_encode(bits)
-    # Upsample by inserting zeros between symbols
-    up_factor = int(round(sps))
-    if abs(sps - up_factor) > 1e-6:
-        # Use fractional upsampling by polyphase filter later
-        # Build discrete-time pulse at higher LCM rate using resample_poly
-        base = np.repeat(symbols, int(math.ceil(sps)))
-        sps_eff = int(math.ceil(sps))
-    else:
-        base = np.zeros(len(symbols) * up_factor)
-        base[::up_factor] = symbols
-        sps_eff = up_factor
-    # Pulse shaping
-    num_taps = max(41, int(span_symbols * sps_eff) | 1)
-    h = raised_cosine(num_taps=num_taps, beta=beta, sps=float(sps_eff))
-    shaped = np.convolve(base, h, mode='same')
-    # If fractional, resample to exact fs
-    if sps_eff != sps:
-        shaped = resample_poly(shaped, up=int(fs), down=int(bitrate * sps_eff))
-        # The above is approximate and could be optimized; in practice, choose fs multiple of bitrate
+    shaper = PolyphaseBpskShaper(fs, bitrate=bitrate, beta=beta, span_symbols=span_symbols)
+    shaper.push_bits(bits)
+    # Let the last pulses ring out into silence
+    shaper.push_symbols(np.zeros(span_symbols))
+    shaped = shaper.read(int(math.ceil(len(bits) * shaper.sps)))
     # Mix to subcarrier
-    t = np.arange(len(shaped)) / fs
-    carrier = np.cos(2 * np.pi * subcarrier_hz * t)
-    return shaped * carrier
+    return shaped * OscillatorBank(fs).carrier([(subcarrier_hz, 1.0)], 0, len(shaped))
 
 
 # =============================
@@ -307,10 +881,132 @@ def bpsk_subcarrier(bits: np.ndarray, fs: float, subcarrier_hz: float, bitrate:
 # =============================
 
 
+def composite_carrier(carriers: Sequence[Tuple[float, float]], t: np.ndarray, phase: float = 0.0) -> np.ndarray:
+    """Sum of level * cos(2*pi*f*t + phase) over (f, level) pairs: mixing one baseband to several
+    carriers is then a single multiply."""
+    out = np.zeros(len(t))
+    for freq, level in carriers:
+        out += level * np.cos(2 * np.pi * freq * t + phase)
+    return out
+
+
+# Longest carrier period kept as a table; anything longer is evaluated directly
+MAX_WAVETABLE_SAMPLES = 1 << 22
+
+
+def _carrier_period(fs: float, carriers: Sequence[Tuple[float, float]]) -> int:
+    period = 1
+    for freq, _ in carriers:
+        cycles = Fraction(freq) / Fraction(fs)
+        period = period * cycles.denominator // math.gcd(period, cycles.denominator)
+    return period
+
+
+@lru_cache(maxsize=64)
+def carrier_table(fs: float, carriers: Tuple[Tuple[float, float], ...], phase: float = 0.0,
+                  dtype: str = "float64") -> Optional[np.ndarray]:
+    """One period of composite_carrier, built once per process and shared read-only by every
+    OscillatorBank; None if the period is longer than MAX_WAVETABLE_SAMPLES."""
+    period = _carrier_period(fs, carriers)
+    if period > MAX_WAVETABLE_SAMPLES:
+        return None
+    table = composite_carrier(carriers, np.arange(period) / fs, phase).astype(dtype)
+    table.setflags(write=False)
+    return table
+
+
+class OscillatorBank:
+    """Phase-locked carriers served as slices of precomputed one-period wave tables.
+
+    Like WaveTable in libJMPX: every carrier (or composite of carriers) is exactly periodic in
+    samples, e.g. 19 kHz at 192 kHz repeats every 192 samples, so one period is computed once
+    per process (carrier_table) and each block is a slice of it, indexed by the shared absolute sample counter. Pilot,
+    38 kHz and the RDS carriers therefore stay locked with no trig calls per block.
+    """
+
+    def __init__(self, fs: float, dtype=np.float64):
+        self.fs = fs
+        self.dtype = np.dtype(dtype)
+        self._tables: dict = {}
+
+    def carrier(self, carriers: Sequence[Tuple[float, float]], start: int, num_samples: int,
+                phase: float = 0.0) -> np.ndarray:
+        """composite_carrier for absolute samples [start, start + num_samples), as a read-only view."""
+        key = (tuple(carriers), phase)
+        entry = self._tables.get(key)
+        if entry is None:
+            table = carrier_table(self.fs, key[0], phase, self.dtype.name)
+            if table is None:
+                t = np.arange(start, start + num_samples) / self.fs
+                return composite_carrier(carriers, t, phase).astype(self.dtype)
+            if len(self._tables) >= 32:
+                # Levels changed many times; drop stale tables
+                self._tables.clear()
+            entry = self._tables[key] = [table, table]
+        table, extended = entry
+        period = len(table)
+        offset = start % period
+        if offset + num_samples > len(extended):
+            # Repeat the period far enough that any block is one contiguous slice
+            extended = np.tile(table, -(-(period + num_samples) // period))
+            extended.setflags(write=False)
+            entry[1] = extended
+        return extended[offset:offset + num_samples]
+
+
+@lru_cache(maxsize=None)
+def design_lowpass(fs: float, cutoff_hz: float = 15000.0, numtaps: int = 513, window="hamming") -> np.ndarray:
+    """Windowed-sinc low-pass taps, designed once per (fs, cutoff, numtaps, window) for the whole process."""
+    taps = firwin(numtaps, cutoff=cutoff_hz, fs=fs, window=window)
+    taps.setflags(write=False)
+    return taps
+
+
+class StereoFirFilter:
+    """FFT overlap-save FIR that filters a stereo pair together, carrying state between blocks.
+
+    Like FastFIRFilterInterleavedStereo in libJMPX, L and R ride through one complex FFT per frame
+    as L + jR; the taps are real, so the real and imaginary parts of the result are the two outputs.
+    """
+
+    def __init__(self, taps: np.ndarray, nfft: int = 8192, dtype=np.float64):
+        m = len(taps)
+        while nfft < 2 * m:
+            nfft *= 2
+        self.taps = taps
+        self.nfft = nfft
+        self.hop = nfft - (m - 1)
+        # scipy.fft keeps single precision end to end
+        self._ctype = np.result_type(dtype, np.complex64)
+        self._spectrum = sp_fft.fft(taps, nfft).astype(self._ctype)
+        self.reset()
+
+    def reset(self):
+        self._history = np.zeros(len(self.taps) - 1, dtype=self._ctype)
+
+    def filter_pair(self, left: np.ndarray, right: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Filter one block of L and R; returns the filtered channels as real/imaginary views."""
+        x = np.empty(len(left), dtype=self._ctype)
+        x.real = left
+        x.imag = right
+        y = np.empty_like(x)
+        m1 = len(self._history)
+        for start in range(0, len(x), self.hop):
+            seg = x[start:start + self.hop]
+            buf = np.concatenate([self._history, seg])
+            frame = sp_fft.ifft(sp_fft.fft(buf, self.nfft) * self._spectrum)
+            y[start:start + len(seg)] = frame[m1:m1 + len(seg)]
+            self._history = buf[len(buf) - m1:]
+        return y.real, y.imag
+
+    def process(self, stereo: np.ndarray) -> np.ndarray:
+        """Filter a (frames, 2) block; equivalent to lfilter(taps, [1.0], stereo, axis=0) with carried state."""
+        left, right = self.filter_pair(stereo[:, 0], stereo[:, 1])
+        return np.stack([left, right], axis=1)
+
+
 def lowpass_stereo(audio: np.ndarray, fs: float, cutoff_hz: float = 15000.0) -> np.ndarray:
-    numtaps = 513
-    fir = firwin(numtaps, cutoff=cutoff_hz, fs=fs)
-    return lfilter(fir, [1.0], audio, axis=0)
+    return StereoFirFilter(design_lowpass(fs, cutoff_hz)).process(audio)
 
 
 def make_mpx(
@@ -322,7 +1018,13 @@ def make_mpx(
     rds2_level: float = DEFAULT_RDS2_LEVEL,
     rds_bits: Optional[np.ndarray] = None,
     enable_rds2: bool = False,
+    rds2_bits: Optional[Sequence[Optional[np.ndarray]]] = None,
 ) -> np.ndarray:
+    """Render a whole signal to MPX in one call.
+
+    By default the RDS2 carriers repeat rds_bits; pass rds2_bits (one array per carrier in
+    RDS2_SUBCARRIER_HZ order) to give each RDS2 stream its own bitstream.
+    """
     assert left.shape == right.shape
     num_samples = left.shape[0]
 
@@ -332,46 +1034,676 @@ def make_mpx(
     lpr = np.mean(stereo, axis=1)  # L+R
     lmr = stereo[:, 0] - stereo[:, 1]  # L-R
 
-    t = np.arange(num_samples) / fs
+    osc = OscillatorBank(fs)
 
     # 19 kHz pilot
-    pilot = pilot_level * np.sin(2 * np.pi * PILOT_HZ * t)
+    pilot = osc.carrier([(PILOT_HZ, pilot_level)], 0, num_samples, phase=-np.pi / 2)
 
     # 38 kHz DSB-SC for L-R
-    stereo_sub = np.cos(2 * np.pi * STEREO_SUBCARRIER_HZ * t)
+    stereo_sub = osc.carrier([(STEREO_SUBCARRIER_HZ, 1.0)], 0, num_samples)
     dsb = lmr * stereo_sub
 
-    # RDS at 57 kHz
+    # RDS at 57 kHz, plus the experimental RDS2 carriers. Each distinct bitstream is shaped once
+    # and mixed to all of its carriers through one composite carrier.
     rds = np.zeros(num_samples)
+    streams: List[Tuple[np.ndarray, List[Tuple[float, float]]]] = []
     if rds_bits is not None and len(rds_bits) > 0:
-        rds_wave = bpsk_subcarrier(rds_bits, fs=fs, subcarrier_hz=RDS0_HZ)
-        rds[: len(rds_wave)] += rds_level * rds_wave[:num_samples]
-
-    # RDS2 experimental
-    if enable_rds2 and rds_bits is not None and len(rds_bits) > 0:
-        for sc in RDS2_SUBCARRIER_HZ:
-            rds2_wave = bpsk_subcarrier(rds_bits, fs=fs, subcarrier_hz=sc)
-            rds[: len(rds2_wave)] += rds2_level * rds2_wave[:num_samples]
+        carriers = [(RDS0_HZ, rds_level)]
+        if enable_rds2 and rds2_bits is None:
+            carriers += [(sc, rds2_level) for sc in RDS2_SUBCARRIER_HZ]
+        streams.append((rds_bits, carriers))
+    if enable_rds2 and rds2_bits is not None:
+        for sc, bits in zip(RDS2_SUBCARRIER_HZ, rds2_bits):
+            if bits is not None and len(bits) > 0:
+                streams.append((bits, [(sc, rds2_level)]))
+    for bits, carriers in streams:
+        shaper = PolyphaseBpskShaper(fs)
+        shaper.push_bits(bits)
+        shaper.push_symbols(np.zeros(shaper.symbols_needed(num_samples)))
+        rds += shaper.read(num_samples) * osc.carrier(carriers, 0, num_samples)
 
     mpx = lpr + pilot + dsb + rds
     return clamp_audio(mpx.astype(np.float32))
 
 
+# =============================
+# Audio processing
+# =============================
+
+# Pre-emphasis shelves off a little above the audio band instead of rising without limit
+PREEMPHASIS_SHELF_HZ = 21000.0
+
+
+@lru_cache(maxsize=None)
+def design_preemphasis(fs: float, tau_us: float, shelf_hz: float = PREEMPHASIS_SHELF_HZ) -> Tuple[np.ndarray, np.ndarray]:
+    """First-order FM pre-emphasis (b, a) at fs: the analog (1 + s*tau) / (1 + s/(2*pi*shelf_hz)) through
+    the bilinear transform, unity gain at DC. Like PreEmphasis in libJMPX."""
+    b, a = bilinear([tau_us * 1e-6, 1.0], [1.0 / (2 * np.pi * shelf_hz), 1.0], fs)
+    b.setflags(write=False)
+    a.setflags(write=False)
+    return b, a
+
+
+class PreEmphasisFilter:
+    """Stateful pre-emphasis for (frames, 2) blocks, one lfilter call per block."""
+
+    def __init__(self, fs: float, tau_us: float = 50.0):
+        self.tau_us = tau_us
+        self._b, self._a = design_preemphasis(fs, tau_us)
+        self.reset()
+
+    def reset(self):
+        self._zi = np.zeros((1, 2))
+
+    def process(self, stereo: np.ndarray) -> np.ndarray:
+        y, self._zi = lfilter(self._b, self._a, stereo, axis=0, zi=self._zi)
+        return y
+
+
+class LookaheadLimiter:
+    """Peak limiter for (frames, 2) blocks that holds the stereo composite at or below ceiling.
+
+    The level it limits is the composite's envelope |L+R|/2 + |L-R|, the most that
+    (L+R)/2 + (L-R)·cos(38 kHz) can reach at any carrier phase, so out-of-phase material is held
+    down as well as mono; the same gain goes on both channels.
+
+    Delays the audio by lookahead_ms so the gain is already down when a peak arrives, with no
+    per-sample Python loop: the gain each sample needs is min-filtered over the lookahead, floored
+    against a one-pole release (so it recovers over release_ms), then averaged over the lookahead
+    so it ramps smoothly. The average only spans samples whose minimum already saw the peak, so
+    the ceiling is never exceeded.
+    """
+
+    def __init__(self, fs: float, ceiling: float = 1.0, lookahead_ms: float = 1.5, release_ms: float = 100.0):
+        self.ceiling = ceiling
+        self.delay = max(1, int(round(lookahead_ms * fs / 1000.0)))
+        self._release = math.exp(-1.0 / (release_ms * fs / 1000.0))
+        self.reset()
+
+    def reset(self):
+        d = self.delay
+        self._audio = np.zeros((d, 2))
+        self._needed = np.ones(d)
+        self._smoothed = np.ones(d)
+        self._release_zi = np.array([self._release])
+
+    def process(self, stereo: np.ndarray) -> np.ndarray:
+        n, d = len(stereo), self.delay
+        peak = np.abs(stereo[:, 0] + stereo[:, 1]) * 0.5 + np.abs(stereo[:, 0] - stereo[:, 1])
+        needed = np.concatenate([self._needed, np.minimum(1.0, self.ceiling / np.maximum(peak, 1e-12))])
+        self._needed = needed[n:]
+        # Lowest gain over each sample and the `delay` samples after it
+        held = minimum_filter1d(needed, d + 1, origin=-((d + 1) // 2))[:n]
+        released, self._release_zi = lfilter([1.0 - self._release], [1.0, -self._release], held,
+                                             zi=self._release_zi)
+        held = np.minimum(held, released)
+        # Average over each sample and the `delay` before it
+        smoothed = np.concatenate([self._smoothed, held])
+        self._smoothed = smoothed[n:]
+        sums = np.concatenate([[0.0], np.cumsum(smoothed)])
+        gain = (sums[d + 1:] - sums[:n]) / (d + 1)
+        audio = np.concatenate([self._audio, stereo])
+        self._audio = audio[n:]
+        return audio[:n] * gain[:, None]
+
+
+class CompositeClipper:
+    """Soft clipper for the stereo composite, applied before pilot and RDS are added so they are
+    never clipped with the audio. Linear up to knee * ceiling, then an arctangent curve that
+    approaches ceiling, like Clipper in libJMPX; the same few array operations on every sample."""
+
+    def __init__(self, ceiling: float = 1.0, knee: float = 0.85):
+        self.ceiling = ceiling
+        self.knee = knee
+
+    def process(self, composite: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        start = self.knee * self.ceiling
+        scale = self.ceiling - start
+        a = np.pi / (2 * scale)
+        over = np.maximum(np.abs(composite) - start, 0.0)
+        # Zero below the knee; above it, how far the arctangent curve pulls the sample in
+        excess = over - np.arctan(over * a) / a
+        return np.subtract(composite, np.copysign(excess, composite).astype(composite.dtype, copy=False), out=out)
+
+
+# =============================
+# Streaming MPX engine
+# =============================
+
+
+class _RdsBasebandStream:
+    """RDS baseband for the engine, driven by the shaper's symbol clock.
+
+    Each block pulls exactly the bits whose pulses reach into it (including the shaping tail)
+    and nothing more, so bit generation tracks airtime and groups run on unbroken across blocks.
+    """
+
+    def __init__(self, gen: RdsBitstreamGenerator, fs: float, dtype=np.float64):
+        self.gen = gen
+        self.shaper = PolyphaseBpskShaper(fs, dtype=dtype)
+
+    def read(self, num_samples: int, out: Optional[np.ndarray] = None) -> np.ndarray:
+        needed = self.shaper.symbols_needed(num_samples)
+        if needed > 0:
+            self.shaper.push_bits(self.gen.generate_bits(needed))
+        return self.shaper.read(num_samples, out=out)
+
+
+class MpxEngine:
+    """Stateful MPX generator for block-by-block streaming.
+
+    Oscillator phase, the stereo low-pass delay line and the RDS shaping state are kept between
+    calls to process(), so rendering a signal in one call or in blocks gives the same samples
+    (to the rounding of the FFT low-pass: a few ulp in float32, ~1e-15 in float64).
+    The whole path runs in dtype (float32 by default; float64 as an accuracy reference) with
+    scratch buffers reused from block to block.
+
+    Optional processing ahead of the stereo encoder: pre-emphasis (preemphasis_us, 50 or 75),
+    a look-ahead limiter on L/R driven by the composite they make, and a soft clipper on the
+    stereo composite. Both keep the audio
+    under the headroom the pilot and RDS levels leave, so the final safety clip never cuts into them.
+    """
+
+    def __init__(
+        self,
+        fs: float,
+        gen: Optional[RdsBitstreamGenerator] = None,
+        pilot_level: float = DEFAULT_PILOT_LEVEL,
+        rds_level: float = DEFAULT_RDS_LEVEL,
+        rds2_level: float = DEFAULT_RDS2_LEVEL,
+        enable_rds2: bool = False,
+        cutoff_hz: float = 15000.0,
+        rds2_gens: Optional[Sequence[RdsBitstreamGenerator]] = None,
+        dtype=np.float32,
+        preemphasis_us: Optional[float] = None,
+        limiter: bool = False,
+        clipper: bool = False,
+    ):
+        self.fs = fs
+        self.pilot_level = pilot_level
+        self.rds_level = rds_level
+        self.rds2_level = rds2_level
+        self.enable_rds2 = enable_rds2
+        self.gen = gen
+        self.dtype = np.dtype(dtype)
+        # Without separate generators the RDS2 carriers repeat the RDS baseband
+        self.rds2_gens = list(rds2_gens) if rds2_gens else []
+        self._lowpass = StereoFirFilter(design_lowpass(fs, cutoff_hz), dtype=self.dtype)
+        self._osc = OscillatorBank(fs, dtype=self.dtype)
+        self._scratch = np.empty((2, 0), dtype=self.dtype)
+        # The audio gets whatever full scale the pilot and RDS injection leave
+        injection = pilot_level + rds_level + (rds2_level * len(RDS2_SUBCARRIER_HZ) if enable_rds2 else 0.0)
+        self.audio_ceiling = max(0.1, 0.999 - injection)
+        self._preemphasis = PreEmphasisFilter(fs, preemphasis_us) if preemphasis_us else None
+        self._limiter = LookaheadLimiter(fs, self.audio_ceiling) if limiter else None
+        self._clipper = CompositeClipper(self.audio_ceiling) if clipper else None
+        self._settings = dict(cutoff_hz=cutoff_hz, preemphasis_us=preemphasis_us, limiter=limiter, clipper=clipper)
+        # Wall-clock seconds spent in each part of process(), accumulated over the engine's life
+        self.stage_seconds = {"processing": 0.0, "lowpass": 0.0, "stereo": 0.0, "rds": 0.0, "rds2": 0.0}
+        self.reset()
+
+    def variant(self, gen: Optional[RdsBitstreamGenerator] = None, rds2_gens=None, **changes) -> "MpxEngine":
+        """A new engine with this one's settings, except the RDS sources and any settings in changes."""
+        settings = dict(pilot_level=self.pilot_level, rds_level=self.rds_level, rds2_level=self.rds2_level,
+                        enable_rds2=self.enable_rds2, dtype=self.dtype, **self._settings)
+        settings.update(changes)
+        return MpxEngine(self.fs, gen, rds2_gens=rds2_gens, **settings)
+
+    def reset(self):
+        self._n = 0
+        self._lowpass.reset()
+        for stage in (self._preemphasis, self._limiter):
+            if stage is not None:
+                stage.reset()
+        self._rds = _RdsBasebandStream(self.gen, self.fs, self.dtype) if self.gen is not None else None
+        self._rds2 = [_RdsBasebandStream(g, self.fs, self.dtype) for g in self.rds2_gens]
+
+    def process(self, left: np.ndarray, right: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Render the next block of MPX, into out (length len(left), engine dtype) if given."""
+        assert left.shape == right.shape
+        num_samples = left.shape[0]
+        if self._scratch.shape[1] < num_samples:
+            self._scratch = np.empty((2, num_samples), dtype=self.dtype)
+        tmp, baseband = self._scratch[0, :num_samples], self._scratch[1, :num_samples]
+        mpx = np.empty(num_samples, dtype=self.dtype) if out is None else out
+
+        t0 = time.perf_counter()
+        if self._preemphasis is not None or self._limiter is not None:
+            stereo = np.stack([left, right], axis=1)
+            if self._preemphasis is not None:
+                stereo = self._preemphasis.process(stereo)
+            if self._limiter is not None:
+                stereo = self._limiter.process(stereo)
+            left, right = stereo[:, 0], stereo[:, 1]
+        t_pre = time.perf_counter()
+        left_f, right_f = self._lowpass.filter_pair(left, right)
+        t1 = time.perf_counter()
+        # L+R (mean of the pair) and L-R on the 38 kHz carrier
+        n, osc = self._n, self._osc
+        np.add(left_f, right_f, out=mpx)
+        mpx *= 0.5
+        np.subtract(left_f, right_f, out=tmp)
+        tmp *= osc.carrier([(STEREO_SUBCARRIER_HZ, 1.0)], n, num_samples)
+        mpx += tmp
+        t_clip = time.perf_counter()
+        if self._clipper is not None:
+            self._clipper.process(mpx, out=mpx)
+        t_clip = time.perf_counter() - t_clip
+        mpx += osc.carrier([(PILOT_HZ, self.pilot_level)], n, num_samples, phase=-np.pi / 2)
+        t2 = time.perf_counter()
+
+        if self._rds is not None:
+            # Shape once, mix the same baseband to every carrier that shares it
+            carriers = [(RDS0_HZ, self.rds_level)]
+            if self.enable_rds2 and not self._rds2:
+                carriers += [(sc, self.rds2_level) for sc in RDS2_SUBCARRIER_HZ]
+            self._rds.read(num_samples, out=baseband)
+            mpx += np.multiply(baseband, osc.carrier(carriers, n, num_samples), out=tmp)
+        t3 = time.perf_counter()
+        if self.enable_rds2:
+            for sc, stream in zip(RDS2_SUBCARRIER_HZ, self._rds2):
+                stream.read(num_samples, out=baseband)
+                mpx += np.multiply(baseband, osc.carrier([(sc, self.rds2_level)], n, num_samples), out=tmp)
+        t4 = time.perf_counter()
+
+        stages = self.stage_seconds
+        stages["processing"] += t_pre - t0 + t_clip
+        stages["lowpass"] += t1 - t_pre
+        stages["stereo"] += t2 - t1 - t_clip
+        stages["rds"] += t3 - t2
+        stages["rds2"] += t4 - t3
+        self._n += num_samples
+        return np.clip(mpx, -0.999, 0.999, out=mpx)
+
+
+# =============================
+# Loop cache
+# =============================
+
+# Audio rendered ahead of a recorded loop so the filters and limiter enter it settled (s)
+LOOP_WARMUP_SECONDS = 2.0
+# Audio a live engine is primed on when it takes over from a loop (s)
+LOOP_HANDOFF_SECONDS = 0.25
+
+
+class _CyclicBits:
+    """Bit source repeating a recorded stretch of groups forever."""
+
+    def __init__(self, bits: np.ndarray):
+        self.bits = bits
+        self._pos = 0
+
+    def generate_bits(self, total_bits: int) -> np.ndarray:
+        idx = (self._pos + np.arange(total_bits)) % len(self.bits)
+        self._pos = (self._pos + total_bits) % len(self.bits)
+        return self.bits[idx]
+
+
+def _carousel_files(carousel: Optional[Rds2FileCarousel]) -> Tuple:
+    return tuple((f["slot"], f["size"], f["crc"], f["share"], f["toggle"]) for f in carousel.index()) if carousel else ()
+
+
+def _wrap_copy(loop: np.ndarray, pos: int, out: np.ndarray) -> int:
+    """Copy len(out) samples of loop from pos into out, wrapping; returns the next position."""
+    filled = 0
+    while filled < len(out):
+        chunk = min(len(out) - filled, len(loop) - pos)
+        out[filled:filled + chunk] = loop[pos:pos + chunk]
+        filled += chunk
+        pos = (pos + chunk) % len(loop)
+    return pos
+
+
+class MpxLoop:
+    """MPX of a looped program rendered once, replayed with no DSP beyond a sum.
+
+    Two loops wrap independently: program (processed audio, stereo multiplex and pilot over
+    the audio loop) and rds (the RDS/RDS2 injection over a whole number of groups). Each is
+    seamless on its own, so their lengths need no common multiple. key and files record the
+    RDS configuration and RDS2 files the loop carries; see render_mpx_loop.
+    """
+
+    def __init__(self, audio: np.ndarray, program: np.ndarray, rds: np.ndarray, program_unit: int,
+                 key: Tuple, files: Tuple):
+        self.audio = audio
+        self.program = program
+        self.rds = rds
+        # Frames per carrier cycle of the program loop
+        self.program_unit = program_unit
+        self.key = key
+        self.files = files
+        self.program_pos = 0
+        self.rds_pos = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self.program.nbytes + self.rds.nbytes
+
+    def read(self, num_samples: int) -> np.ndarray:
+        out = np.empty(num_samples, dtype=self.program.dtype)
+        rds = np.empty_like(out)
+        self.program_pos = _wrap_copy(self.program, self.program_pos, out)
+        self.rds_pos = _wrap_copy(self.rds, self.rds_pos, rds)
+        out += rds
+        return np.clip(out, -0.999, 0.999, out=out)
+
+
+def render_mpx_loop(engine: MpxEngine, stereo: np.ndarray, carousel: Optional[Rds2FileCarousel] = None,
+                    max_seconds: float = 300.0, path: Optional[str] = None) -> MpxLoop:
+    """Render the MPX engine would make of stereo played on repeat, once, as an MpxLoop.
+
+    The program loop is one pass of stereo cut to a whole number of pilot periods (under a
+    millisecond goes), so the carriers run on over the seam; a source under a second is
+    repeated until they line up instead. The RDS loop is a whole number of groups, lined up
+    with the RDS clock and carriers, long enough for every file of carousel to go out. It is
+    one whole cycle of engine.gen's group rates scheduled over the loop's own length (with
+    every group of the configuration in it), so each type keeps its share across the seam.
+    engine is only read (its settings and RDS configuration);
+    carousel is drawn from, so pass one that is not on air (Rds2FileCarousel.copy()).
+
+    With path the loop is written to that .npy file and memory-mapped rather than held in RAM.
+    Raises ValueError if the RDS cannot loop (CT is on) or a loop would exceed max_seconds.
+    """
+    fs, gen = engine.fs, engine.gen
+    cfg = gen.latest_config() if gen is not None else None
+    if cfg is not None and cfg.ct:
+        raise ValueError("the clock time (CT) changes every minute, so the RDS cannot loop")
+    max_frames = int(max_seconds * fs)
+
+    # Program: carriers line up with the audio at the seam
+    program_unit = _carrier_period(fs, [(PILOT_HZ, 1.0), (STEREO_SUBCARRIER_HZ, 1.0)])
+    frames = len(stereo)
+    aligned = frames * program_unit // math.gcd(frames, program_unit)
+    if aligned <= max(frames, fs):
+        audio = np.tile(stereo, (aligned // frames, 1))
+    else:
+        audio = stereo[:frames - frames % program_unit]
+    if not 0 < len(audio) <= max_frames:
+        raise ValueError(f"the audio loop cannot be lined up with the carriers in {max_seconds:g} s")
+
+    # RDS: whole groups, a whole number of RDS carrier cycles, every group and file sent once
+    group_frames = 104 * Fraction(fs) / Fraction(RDS_BITRATE)
+    rds_carriers = [(RDS0_HZ, 1.0)] + ([(sc, 1.0) for sc in RDS2_SUBCARRIER_HZ] if engine.enable_rds2 else [])
+    rds_unit = _carrier_period(fs, rds_carriers)
+    unit_groups = group_frames.denominator * rds_unit // math.gcd(group_frames.numerator, rds_unit)
+    sources: list = []
+    groups = 1
+    if engine.enable_rds2 and carousel is not None:
+        streams = [carousel.stream() for _ in RDS2_SUBCARRIER_HZ]
+        sources += streams
+        files = carousel.index()
+        total = sum(f["share"] for f in files)
+        # A slot gets its share of the picks, shared out over the streams
+        passes = [math.ceil((f["segments"] + 1) * total / f["share"]) + len(files) for f in files]
+        groups = max(-(-p // len(streams)) for p in passes)
+    groups = -(-groups // unit_groups) * unit_groups
+    max_groups = int(max_frames / group_frames)
+    if gen is not None:
+        # The first length whose schedule is exactly that many groups and sends every group
+        while groups <= max_groups:
+            rds_gen = RdsBitstreamGenerator(replace(cfg), rates=gen.rates, cycle_seconds=groups / RDS_GROUP_RATE)
+            if len(rds_gen._schedule[1]) == groups and rds_gen.cycle_groups() <= groups:
+                break
+            groups += unit_groups
+        sources.insert(0, rds_gen)
+    if groups > max_groups:
+        raise ValueError(f"a full RDS cycle takes longer than {max_seconds:g} s")
+    bits = [source.generate_bits(groups * 104) for source in sources]
+    # Differential encoding flips the carrier phase on every 1; an odd count would flip it at the seam
+    if any(int(b.sum()) % 2 for b in bits):
+        bits = [np.tile(b, 2) for b in bits]
+        groups *= 2
+    rds_frames = int(groups * group_frames)
+    if rds_frames > max_frames:
+        raise ValueError(f"a full RDS cycle takes longer than {max_seconds:g} s")
+
+    shape = (len(audio) + rds_frames,)
+    if path:
+        store = np.lib.format.open_memmap(path, mode="w+", dtype=engine.dtype, shape=shape)
+    else:
+        store = np.empty(shape, dtype=engine.dtype)
+    program, rds = store[:len(audio)], store[len(audio):]
+
+    def record(renderer: MpxEngine, source: np.ndarray, out: np.ndarray, warmup: int):
+        # The warm-up ends on loop sample 0 of source, with the carriers at phase 0
+        chunk = int(fs)
+        for start in range(-warmup, len(out), chunk):
+            stop = min(start + chunk, len(out))
+            block = source[np.arange(start, stop) % len(source)]
+            mpx = renderer.process(block[:, 0], block[:, 1])
+            if stop > 0:
+                out[max(start, 0):stop] = mpx[max(start, 0) - start:]
+
+    warmup = -(-int(LOOP_WARMUP_SECONDS * fs) // program_unit) * program_unit
+    record(engine.variant(), audio, program, warmup)
+    if sources:
+        rds_engine = engine.variant(_CyclicBits(bits[0]), [_CyclicBits(b) for b in bits[1:]], pilot_level=0.0,
+                                    preemphasis_us=None, limiter=False, clipper=False)
+        record(rds_engine, np.zeros((1, 2), dtype=engine.dtype), rds, warmup)
+    else:
+        rds[:] = 0
+    if path:
+        store.flush()
+    return MpxLoop(audio, program, rds, program_unit, _carousel_key(cfg) if cfg is not None else None,
+                   _carousel_files(carousel))
+
+
+class LoopedProgram:
+    """MPX for a stereo source on repeat: the loop is replayed while it still matches, else engine renders live.
+
+    Once engine.gen's configuration or the RDS2 files on carousel differ from what loop carries,
+    engine (which must not have rendered anything yet) takes over for good at the same audio
+    position, primed on the audio before it so the filters and carriers run on; the RDS
+    restarts from engine.gen. Without a loop every block is rendered live.
+    """
+
+    def __init__(self, stereo: np.ndarray, engine: MpxEngine, loop: Optional[MpxLoop] = None,
+                 carousel: Optional[Rds2FileCarousel] = None):
+        self.engine = engine
+        self.loop = loop
+        self.carousel = carousel
+        self.stereo = loop.audio if loop is not None else stereo
+        self.position = 0
+
+    def _loop_current(self) -> bool:
+        gen = self.engine.gen
+        key = _carousel_key(gen.latest_config()) if gen is not None else None
+        return key == self.loop.key and _carousel_files(self.carousel) == self.loop.files
+
+    def _live(self, num_samples: int) -> np.ndarray:
+        block = self.stereo[(self.position + np.arange(num_samples)) % len(self.stereo)]
+        self.position = (self.position + num_samples) % len(self.stereo)
+        return self.engine.process(block[:, 0], block[:, 1])
+
+    def _handoff(self):
+        loop, self.loop = self.loop, None
+        unit = loop.program_unit
+        # End the priming with the engine's carriers where the loop left them
+        prime = loop.program_pos % unit + unit * -(-int(LOOP_HANDOFF_SECONDS * self.engine.fs) // unit)
+        self.position = (loop.program_pos - prime) % len(self.stereo)
+        self._live(prime)
+
+    def read(self, num_samples: int) -> np.ndarray:
+        """The next num_samples of MPX (a new array)."""
+        if self.loop is not None and not self._loop_current():
+            self._handoff()
+        if self.loop is not None:
+            return self.loop.read(num_samples)
+        return self._live(num_samples)
+
+
 # =============================
 # Audio I/O helpers
 # =============================
 
+@lru_cache(maxsize=None)
+def resampler_taps(src_fs: int, dst_fs: int) -> Tuple[int, int, np.ndarray, int]:
+    """Anti-aliasing filter for src_fs -> dst_fs, designed once per rate pair.
+
+    Uses the same Kaiser-windowed design and delay compensation as scipy's resample_poly and
+    returns (up, down, taps, delay), delay being the number of leading outputs to discard.
+    """
+    g = math.gcd(int(src_fs), int(dst_fs))
+    up, down = int(dst_fs) // g, int(src_fs) // g
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    h = firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)) * up
+    pre_pad = down - half_len % down
+    h = np.concatenate([np.zeros(pre_pad), h])
+    h.setflags(write=False)
+    return up, down, h, (half_len + pre_pad) // down
+
+
+class StreamingResampler:
+    """Stateful polyphase resampler for (frames, channels) blocks, all channels in one upfirdn call.
+
+    Feeding a signal through process() in any block sizes and then flush() gives the same
+    samples as resample_poly on the whole signal.
+    """
+
+    def __init__(self, src_fs: int, dst_fs: int, channels: int = 2):
+        self.up, self.down, self._taps, self._delay = resampler_taps(src_fs, dst_fs)
+        self.channels = channels
+        # Inputs an output can reach back to, rounded so the history always starts on a
+        # multiple of down and its first output lands on a whole output index
+        self._reach = -(-len(self._taps) // self.up)
+        self._hist_start = 0
+        self._history = np.zeros((0, channels))
+        self._consumed = 0
+        self._next_out = 0
+
+    def _run(self, block: np.ndarray, out_end: int) -> np.ndarray:
+        x = np.concatenate([self._history, block])
+        origin = self._hist_start * self.up // self.down
+        y = upfirdn(self._taps, x, self.up, self.down, axis=0)
+        # Drop the filter's group delay at the very start
+        first = max(self._next_out, self._delay)
+        out = y[first - origin:out_end - origin] if out_end > first else y[:0]
+        keep_from = ((self._consumed - self._reach) // self.down) * self.down
+        keep_from = max(keep_from, self._hist_start)
+        self._history = x[keep_from - self._hist_start:]
+        self._hist_start = keep_from
+        self._next_out = max(self._next_out, out_end)
+        return out.astype(np.float32)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Resample the next input block; returns every output sample it completes."""
+        block = np.asarray(block, dtype=np.float64).reshape(-1, self.channels)
+        self._consumed += len(block)
+        # Output m needs input floor(m * down / up), so everything below ceil(consumed * up / down) is ready
+        return self._run(block, -(-self._consumed * self.up // self.down))
+
+    def flush(self) -> np.ndarray:
+        """Ring out the filter at end of input; total output is then ceil(frames * up / down)."""
+        total_out = self._delay - (-self._consumed * self.up // self.down)
+        last_input = ((total_out - 1) * self.down) // self.up
+        pad = max(0, last_input + 1 - self._consumed)
+        self._consumed += pad
+        return self._run(np.zeros((pad, self.channels)), total_out)
+
+
+class AdaptiveResampler:
+    """Variable-ratio resampler for (frames, channels) blocks, for bridging two free-running clocks.
+
+    Uses 4-point (cubic Lagrange) interpolation; the read position carries over between blocks,
+    so ratio (output samples per input sample) may change before any block without a click.
+    At ratio 1 the input passes through unchanged.
+    """
+
+    def __init__(self, channels: int = 2, ratio: float = 1.0):
+        self.channels = channels
+        self.ratio = ratio
+        # One sample of history before the read position, which starts on the first input sample
+        self._history = np.zeros((1, channels), dtype=np.float32)
+        self._pos = 1.0
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        x = np.concatenate([self._history, np.asarray(block, dtype=np.float32).reshape(-1, self.channels)])
+        step = 1.0 / self.ratio
+        # Interpolating at t needs x[floor(t) - 1 .. floor(t) + 2]
+        n = max(0, int(math.ceil((len(x) - 2 - self._pos) / step)))
+        t = self._pos + step * np.arange(n)
+        i = t.astype(np.int64)
+        f = (t - i)[:, None].astype(np.float32)
+        fm1, fp1, fm2 = f - 1, f + 1, f - 2
+        out = x[i - 1] * (-f * fm1 * fm2 / 6)
+        out += x[i] * (fp1 * fm1 * fm2 / 2)
+        out += x[i + 1] * (-fp1 * f * fm2 / 2)
+        out += x[i + 2] * (fp1 * f * fm1 / 6)
+        pos = self._pos + n * step
+        keep = int(pos) - 1
+        self._history = x[keep:]
+        self._pos = pos - keep
+        return out
+
+
+class ClockDriftController:
+    """PI loop that holds a buffer's fill level at target_frames by trimming a resampling ratio.
+
+    The fill level is smoothed over smoothing_s, then ratio = 1 - (kp * error + ki * integral),
+    with the error in seconds and the correction clamped to max_ppm. Once settled the integral
+    equals the relative drift between the clocks, reported as drift_ppm (positive when the
+    producing clock runs fast). The default gains settle in a couple of minutes and keep a
+    few hundred ppm of drift within a few ms of the target.
+    """
+
+    def __init__(self, target_frames: int, fs: float, kp: float = 0.06, ki: float = 0.001,
+                 max_ppm: float = 1000.0, smoothing_s: float = 2.0):
+        self.target_frames = target_frames
+        self.fs = fs
+        self.kp = kp
+        self.ki = ki
+        self.max_correction = max_ppm * 1e-6
+        self.smoothing_s = smoothing_s
+        self.ratio = 1.0
+        self.fill_frames: Optional[float] = None
+        self._integral = 0.0
+
+    @property
+    def drift_ppm(self) -> float:
+        return self._integral * 1e6
+
+    @property
+    def error_ms(self) -> float:
+        return 1e3 * ((self.fill_frames or self.target_frames) - self.target_frames) / self.fs
+
+    def update(self, fill_frames: int, dt: float) -> float:
+        """Feed the current fill level, dt seconds after the last update; returns the new ratio."""
+        if self.fill_frames is None:
+            self.fill_frames = float(fill_frames)
+        else:
+            self.fill_frames += (fill_frames - self.fill_frames) * dt / (self.smoothing_s + dt)
+        error = (self.fill_frames - self.target_frames) / self.fs
+        limit = self.max_correction
+        self._integral = min(limit, max(-limit, self._integral + self.ki * error * dt))
+        correction = min(limit, max(-limit, self.kp * error + self._integral))
+        self.ratio = 1.0 - correction
+        return self.ratio
+
+
+def _rechunk(blocks: Iterator[np.ndarray], block_frames: int) -> Iterator[np.ndarray]:
+    """Regroup a stream of (frames, 2) blocks into blocks of exactly block_frames (the last may be short)."""
+    pending: List[np.ndarray] = []
+    count = 0
+    for block in blocks:
+        pending.append(block)
+        count += len(block)
+        if count >= block_frames:
+            merged = np.concatenate(pending)
+            full = (count // block_frames) * block_frames
+            for idx in range(0, full, block_frames):
+                yield merged[idx:idx + block_frames]
+            pending = [merged[full:]]
+            count -= full
+    if count:
+        yield np.concatenate(pending)
+
+
 def read_audio_file(path: str, target_fs: int) -> Tuple[np.ndarray, int]:
-    data, fs = sf.read(path, always_2d=True)
-    if data.shape[1] == 1:
-        data = np.repeat(data, 2, axis=1)
-    if fs != target_fs:
-        # Resample each channel
-        left = resample_poly(data[:, 0], up=target_fs, down=fs)
-        right = resample_poly(data[:, 1], up=target_fs, down=fs)
-        data = np.stack([left, right], axis=1)
-        fs = target_fs
-    return data.astype(np.float32), fs
+    blocks = list(iter_audio_blocks(path, target_fs, block_frames=1 << 16))
+    if not blocks:
+        return np.zeros((0, 2), dtype=np.float32), target_fs
+    return np.concatenate(blocks), target_fs
 
 
 def generate_tone(duration_s: float, fs: int, freq_hz: float = 1000.0, level_db: float = -12.0) -> np.ndarray:
@@ -382,6 +1714,51 @@ def generate_tone(duration_s: float, fs: int, freq_hz: float = 1000.0, level_db:
     return np.stack([left, right], axis=1).astype(np.float32)
 
 
+def tone_period(fs: int, freq_hz: float = 1000.0, level_db: float = -12.0) -> np.ndarray:
+    """One whole period of generate_tone's signal (the same samples), for looping; e.g. 192 frames for 1 kHz at 192 kHz."""
+    period = (Fraction(freq_hz).limit_denominator(1000) / fs).denominator
+    return generate_tone((period + 0.5) / fs, fs, freq_hz, level_db)
+
+
+def iter_audio_blocks(path: str, target_fs: int, block_frames: int) -> Iterator[np.ndarray]:
+    """Yield (block_frames, 2) float32 blocks of an audio file at target_fs (the last may be short).
+    The file is decoded and, if needed, resampled one block at a time, so output can start at once.
+    """
+    src_fs = sf.info(path).samplerate
+    # Read roughly one output block worth of input per step
+    read_frames = max(1, int(block_frames * src_fs / target_fs))
+
+    def decoded() -> Iterator[np.ndarray]:
+        for block in sf.blocks(path, blocksize=read_frames, dtype='float32', always_2d=True):
+            if block.shape[1] == 1:
+                block = np.repeat(block, 2, axis=1)
+            yield block[:, :2]
+
+    if src_fs == target_fs:
+        yield from _rechunk(decoded(), block_frames)
+        return
+
+    resampler = StreamingResampler(src_fs, target_fs)
+
+    def resampled() -> Iterator[np.ndarray]:
+        for block in decoded():
+            yield resampler.process(block)
+        yield resampler.flush()
+
+    yield from _rechunk(resampled(), block_frames)
+
+
+def iter_tone_blocks(duration_s: float, fs: int, block_frames: int, freq_hz: float = 1000.0,
+                     level_db: float = -12.0) -> Iterator[np.ndarray]:
+    """Blockwise generate_tone: same samples, one (frames, 2) block at a time."""
+    total = int(duration_s * fs)
+    amp = db_to_linear(level_db)
+    for idx in range(0, total, block_frames):
+        t = np.arange(idx, min(idx + block_frames, total)) / fs
+        left = amp * np.sin(2 * np.pi * freq_hz * t)
+        yield np.stack([left, left], axis=1).astype(np.float32)
+
+
 def find_device_index_by_name(name_query: str, is_output: Optional[bool] = None) -> Optional[int]:
     """Find a device index whose name contains the given query (case-insensitive).
     If is_output is True, restrict to output-capable devices. If False, input-capable. If None, any.
@@ -406,6 +1783,1040 @@ def find_device_index_by_name(name_query: str, is_output: Optional[bool] = None)
     return candidates[0][0]
 
 
+# =============================
+# Real-time output buffering
+# =============================
+
+
+class AudioRingBuffer:
+    """Preallocated single-producer/single-consumer float32 ring buffer for a PortAudio callback.
+
+    The callback side (read_into) never blocks or allocates: it copies what is buffered and
+    zero-fills the rest, counting an underrun. The producer side (write) is non-blocking too and
+    counts an overrun when a block does not fit; wait_for_space() lets a producer that can be
+    throttled keep a fixed lookahead instead. Positions are monotonic frame counters, each written
+    by only one side, so no lock is needed.
+    """
+
+    def __init__(self, capacity_frames: int):
+        self.capacity = int(capacity_frames)
+        self._buf = np.zeros(self.capacity, dtype=np.float32)
+        self._write_pos = 0
+        self._read_pos = 0
+        self.underruns = 0
+        self.overruns = 0
+        self.closed = False
+        self._last_read = 0
+        self._last_read_time = 0.0
+
+    @property
+    def available(self) -> int:
+        return self._write_pos - self._read_pos
+
+    @property
+    def playing(self) -> bool:
+        """True once the device has read from the ring."""
+        return self._last_read_time > 0
+
+    def latency_frames(self, fs: float) -> float:
+        """Frames queued ahead of the DAC: what is buffered plus the part of the last block handed to
+        the device that it has not played yet. Unlike available, this does not step by a whole block
+        at every callback, so it can steer a clock-drift loop."""
+        played = (time.monotonic() - self._last_read_time) * fs
+        return self.available + max(0.0, self._last_read - played)
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.available
+
+    def close(self):
+        """Mark the end of the stream; the reader stops counting underruns once drained."""
+        self.closed = True
+
+    @property
+    def drained(self) -> bool:
+        return self.closed and self.available == 0
+
+    def write(self, block: np.ndarray) -> int:
+        n = min(len(block), self.free)
+        if n < len(block):
+            self.overruns += 1
+        start = self._write_pos % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = block[:first]
+        self._buf[:n - first] = block[first:n]
+        self._write_pos += n
+        return n
+
+    def wait_for_space(self, frames: int, lookahead_frames: int, poll_s: float = 0.002,
+                       stop: Sequence[threading.Event] = ()) -> bool:
+        """Sleep until frames fit without pushing the fill level past lookahead_frames.
+        Returns False if any of the stop events is set first."""
+        limit = max(frames, min(lookahead_frames, self.capacity))
+        while self.available + frames > limit:
+            if any(event.is_set() for event in stop):
+                return False
+            time.sleep(poll_s)
+        return True
+
+    def read_into(self, out: np.ndarray) -> int:
+        frames = len(out)
+        n = min(frames, self.available)
+        start = self._read_pos % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buf[start:start + first]
+        out[first:n] = self._buf[:n - first]
+        if n < frames:
+            out[n:] = 0
+            if not self.closed:
+                self.underruns += 1
+        self._read_pos += n
+        self._last_read = frames
+        self._last_read_time = time.monotonic()
+        return n
+
+
+def _ring_callback(ring: AudioRingBuffer):
+    """sounddevice output callback that plays mono MPX from ring, duplicated to every channel."""
+
+    def callback(outdata, frames, time_info, status):
+        ring.read_into(outdata[:, 0])
+        if outdata.shape[1] > 1:
+            outdata[:, 1:] = outdata[:, :1]
+        if ring.drained:
+            raise sd.CallbackStop
+
+    return callback
+
+
+# =============================
+# Output sinks
+# =============================
+
+
+class MpxSink:
+    """Somewhere rendered MPX blocks go. write() is called from the producer and must never block;
+    blocks are shared read-only between all sinks, so a sink must not modify or keep a reference
+    it expects to change."""
+
+    name = "sink"
+
+    def __init__(self):
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self._closed = threading.Event()
+
+    def start(self):
+        """Called once the producer is running."""
+
+    def write(self, block: np.ndarray):
+        self.frames += len(block)
+
+    def close(self):
+        """End of stream: deliver what is pending, then finish."""
+        self._closed.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """True once everything written has been delivered after close()."""
+        return self._closed.wait(timeout)
+
+    def stop(self):
+        """Release the output at once (after wait(), or on interrupt)."""
+
+    @property
+    def queued(self) -> int:
+        return 0
+
+
+class NullSink(MpxSink):
+    """Discards blocks (counting them), for benchmarks and dry runs."""
+
+    name = "null"
+
+
+class DeviceSink(MpxSink):
+    """The sound device: blocks go into an AudioRingBuffer that the PortAudio callback plays from.
+
+    This is the pacing sink: the producer waits for room in its ring so that lookahead_frames stay
+    buffered, and start() opens the device only once that lookahead is primed.
+    """
+
+    name = "device"
+
+    def __init__(self, fs: int, blocksize: int, lookahead_frames: int):
+        super().__init__()
+        self.fs = fs
+        self.blocksize = blocksize
+        self.lookahead_frames = lookahead_frames
+        self.ring = AudioRingBuffer(lookahead_frames + 2 * blocksize)
+        self._done = threading.Event()
+        self._stream = None
+
+    def start(self):
+        while self.ring.available < self.lookahead_frames - self.blocksize and not self.ring.closed:
+            time.sleep(0.01)
+        self._stream = sd.OutputStream(channels=1, dtype='float32', callback=_ring_callback(self.ring),
+                                       blocksize=self.blocksize, samplerate=self.fs, finished_callback=self._done.set)
+        self._stream.start()
+
+    def wait_for_space(self, frames: int, stop: Optional[threading.Event] = None) -> bool:
+        """Wait for room in the ring; False if the device stream has ended (nothing drains it any
+        more) or stop is set."""
+        stops = (self._done,) if stop is None else (self._done, stop)
+        return self.ring.wait_for_space(frames, self.lookahead_frames, stop=stops)
+
+    def write(self, block: np.ndarray):
+        self.frames += self.ring.write(block)
+
+    def close(self):
+        self.ring.close()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    @property
+    def queued(self) -> int:
+        return self.ring.available
+
+
+class ThreadedSink(MpxSink, ABC):
+    """Runs a blocking writer (disk, pipe, socket) on its own thread behind a bounded queue of
+    block references. When the writer falls behind, blocks are dropped and counted rather than
+    stalling the producer, so a slow disk never holds up the device."""
+
+    def __init__(self, max_blocks: int = 64):
+        super().__init__()
+        # (stream frame index, block); the index keeps counting across dropped blocks
+        self._queue: "queue.Queue[Tuple[int, np.ndarray]]" = queue.Queue(maxsize=max_blocks)
+        self._offset = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, block: np.ndarray):
+        try:
+            self._queue.put_nowait((self._offset, block))
+        except queue.Full:
+            self.dropped += 1
+        self._offset += len(block)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    start, block = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    # close() only ends the stream once everything queued is delivered
+                    if self._closed.is_set():
+                        break
+                    continue
+                try:
+                    if self._consume(block, start):
+                        self.frames += len(block)
+                    else:
+                        self.dropped += 1
+                except (OSError, RuntimeError) as e:
+                    self.dropped += 1
+                    self.errors += 1
+                    self.last_error = str(e)
+        finally:
+            self._finish()
+
+    @abstractmethod
+    def _consume(self, block: np.ndarray, start: int) -> bool:
+        """Deliver one block (starting at stream frame start), blocking as long as needed;
+        False if it was discarded."""
+
+    def _finish(self):
+        pass
+
+
+def _pcm_bytes(block: np.ndarray) -> memoryview:
+    # float32 blocks go out as-is; only a float64 path needs converting
+    return memoryview(np.ascontiguousarray(block, dtype='<f4')).cast('B')
+
+
+class RecorderSink(ThreadedSink):
+    """Records to WAV/FLAC (24-bit, format from the extension). With segment_seconds a new file is
+    started every segment, named <stem>-<YYYYmmdd-HHMMSS><ext> after its start time, splitting
+    blocks at the exact frame so consecutive files join seamlessly."""
+
+    def __init__(self, path: str, fs: int, segment_seconds: Optional[float] = None, max_blocks: int = 64):
+        self.path = path
+        self.fs = fs
+        self.segment_frames = int(round(segment_seconds * fs)) if segment_seconds else None
+        self.name = f"record:{path}"
+        self.files: List[str] = []
+        self._file: Optional[sf.SoundFile] = None
+        self._file_frames = 0
+        super().__init__(max_blocks)
+
+    def _open(self):
+        path = self.path
+        if self.segment_frames:
+            stem, ext = os.path.splitext(self.path)
+            stem = f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}"
+            path, n = f"{stem}{ext}", 1
+            while os.path.exists(path):
+                path, n = f"{stem}-{n}{ext}", n + 1
+        self._file = sf.SoundFile(path, 'w', samplerate=self.fs, channels=1, subtype='PCM_24')
+        self._file_frames = 0
+        self.files.append(path)
+
+    def _consume(self, block: np.ndarray, start: int) -> bool:
+        while len(block):
+            if self._file is None:
+                self._open()
+            n = len(block)
+            if self.segment_frames:
+                n = min(n, self.segment_frames - self._file_frames)
+            self._file.write(block[:n])
+            self._file_frames += n
+            block = block[n:]
+            if self.segment_frames and self._file_frames >= self.segment_frames:
+                self._file.close()
+                self._file = None
+        return True
+
+    def _finish(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class PipeSink(ThreadedSink):
+    """Raw little-endian float32 mono PCM to a file, FIFO or stdout ("-"); a FIFO is opened on the
+    sink's thread, so waiting for a reader does not hold up anything else."""
+
+    def __init__(self, path: str, max_blocks: int = 64):
+        self.path = path
+        self.name = f"pipe:{path}"
+        self._out = None
+        super().__init__(max_blocks)
+
+    def _consume(self, block: np.ndarray, start: int) -> bool:
+        if self._out is None:
+            self._out = sys.stdout.buffer if self.path == "-" else open(self.path, "wb")
+        self._out.write(_pcm_bytes(block))
+        return True
+
+    def _finish(self):
+        if self._out is not None:
+            self._out.flush()
+            if self._out is not sys.stdout.buffer:
+                self._out.close()
+
+
+class SocketSink(ThreadedSink):
+    """Raw little-endian float32 mono PCM over a TCP connection to host:port. If the connection
+    fails or drops, blocks are discarded (counted as dropped) and it reconnects every few seconds."""
+
+    RETRY_S = 2.0
+
+    def __init__(self, host: str, port: int, max_blocks: int = 64):
+        self.host = host
+        self.port = port
+        self.name = f"socket:{host}:{port}"
+        self._sock: Optional[socket.socket] = None
+        self._next_try = 0.0
+        super().__init__(max_blocks)
+
+    def _consume(self, block: np.ndarray, start: int) -> bool:
+        if self._sock is None:
+            if time.monotonic() < self._next_try:
+                return False
+            self._next_try = time.monotonic() + self.RETRY_S
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.RETRY_S)
+        try:
+            self._sock.sendall(_pcm_bytes(block))
+        except OSError:
+            self._sock.close()
+            self._sock = None
+            raise
+        return True
+
+    def _finish(self):
+        if self._sock is not None:
+            self._sock.close()
+
+
+def open_sink(spec: str, fs: int, blocksize: int, lookahead_frames: int) -> MpxSink:
+    """Build a sink from a spec: device | null | record:PATH[,segment=SECONDS] | pipe:PATH|- |
+    socket:HOST:PORT | udp://HOST:PORT[,format=f32|s24][,frames=N] | tcp://HOST:PORT[,...], each
+    optionally followed by ,queue=BLOCKS. Raises ValueError on a bad spec."""
+    kind, _, rest = spec.partition(":")
+    if rest.startswith("//"):
+        rest = rest[2:]
+    target, *opts = rest.split(",") if rest else [""]
+    try:
+        options = dict(opt.split("=", 1) for opt in opts)
+    except ValueError:
+        raise ValueError(f"bad sink options in {spec!r}")
+    max_blocks = int(options.pop("queue", 64))
+    segment = options.pop("segment", None)
+    if kind in ("udp", "tcp"):
+        host, _, port = target.rpartition(":")
+        fmt = options.pop("format", "f32")
+        frames = options.pop("frames", None)
+        if options:
+            raise ValueError(f"unknown sink option(s) in {spec!r}: {', '.join(options)}")
+        return NetworkSink(kind, host or "127.0.0.1", int(port), fs, fmt=fmt,
+                           packet_frames=int(frames) if frames else None, max_blocks=max_blocks)
+    if options:
+        raise ValueError(f"unknown sink option(s) in {spec!r}: {', '.join(options)}")
+    if kind == "device":
+        return DeviceSink(fs, blocksize, lookahead_frames)
+    if kind == "null":
+        return NullSink()
+    if not target:
+        raise ValueError(f"sink {spec!r} needs a target")
+    if kind == "record":
+        return RecorderSink(target, fs, segment_seconds=float(segment) if segment else None, max_blocks=max_blocks)
+    if kind == "pipe":
+        return PipeSink(target, max_blocks=max_blocks)
+    if kind == "socket":
+        host, _, port = target.rpartition(":")
+        return SocketSink(host or "127.0.0.1", int(port), max_blocks=max_blocks)
+    raise ValueError(f"unknown sink {spec!r}")
+
+
+class SinkFanout:
+    """Delivers every rendered block to all sinks at once, as one shared read-only array.
+
+    write() paces the producer on the device ring when there is a device sink, otherwise on the
+    wall clock (keeping at most lookahead_frames ahead of real time); the other sinks only queue.
+    If the device stream ends or fails, pacing falls back to the wall clock so the other sinks
+    carry on rather than the producer waiting forever on a ring nothing drains. Once stop is set,
+    write() stops waiting and drops the block, so a producer looping until stop ends promptly.
+    """
+
+    def __init__(self, sinks: Sequence[MpxSink], fs: int, lookahead_frames: int,
+                 stop: Optional[threading.Event] = None):
+        self.sinks = list(sinks)
+        self.fs = fs
+        self.lookahead_frames = lookahead_frames
+        self.stop_event = stop
+        self.device = next((s for s in self.sinks if isinstance(s, DeviceSink)), None)
+        # The sink write() paces on; None once the device has stopped, or without one
+        self._pacer = self.device
+        self._clock_start: Optional[float] = None
+        self._frames = 0
+
+    @property
+    def ring(self) -> Optional[AudioRingBuffer]:
+        return self.device.ring if self.device is not None else None
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    def _stopped(self) -> bool:
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def _pace(self, frames: int) -> bool:
+        if self._pacer is not None:
+            if self._pacer.wait_for_space(frames, stop=self.stop_event):
+                return True
+            if self._stopped():
+                return False
+            self._pacer = None
+        now = time.monotonic()
+        if self._clock_start is None:
+            self._clock_start = now
+        ahead = (self._frames + frames - self.lookahead_frames) / self.fs - (now - self._clock_start)
+        if ahead > 0:
+            if self.stop_event is None:
+                time.sleep(ahead)
+            elif self.stop_event.wait(ahead):
+                return False
+        self._frames += frames
+        return True
+
+    def write(self, block: np.ndarray, pace: bool = True) -> bool:
+        """Deliver block to every sink; False, with the block dropped, if stop was set while pacing."""
+        block.setflags(write=False)
+        if pace and not self._pace(len(block)):
+            return False
+        for sink in self.sinks:
+            sink.write(block)
+        return True
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for sink in self.sinks:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not sink.wait(remaining):
+                return False
+        return True
+
+    def stop(self):
+        for sink in self.sinks:
+            sink.stop()
+
+
+# =============================
+# Network MPX
+# =============================
+
+# Packet: 32-byte little-endian header, then nframes mono samples (float32, or packed signed 24-bit).
+# Header: magic, version, format, nframes, sequence number, stream index of the first sample,
+# sender wall-clock time (ns) and sample rate. Over TCP the same packets are sent back to back.
+MPX_PACKET_MAGIC = b"MPX1"
+MPX_PACKET_VERSION = 1
+_MPX_PACKET_HEADER = struct.Struct("<4sBBHIQqI")
+MPX_PACKET_FORMATS = {"f32": 0, "s24": 1}
+_MPX_SAMPLE_BYTES = {0: 4, 1: 3}
+# Frames per packet that keep one packet inside a 1500-byte Ethernet MTU
+_MPX_DEFAULT_PACKET_FRAMES = {"f32": 360, "s24": 480}
+_S24_SCALE = 8388607.0
+
+
+def _encode_s24(samples: np.ndarray) -> np.ndarray:
+    ints = np.clip(np.rint(samples * _S24_SCALE), -_S24_SCALE - 1, _S24_SCALE).astype('<i4')
+    return ints.view(np.uint8).reshape(-1, 4)[:, :3]
+
+
+def _decode_s24(payload: np.ndarray) -> np.ndarray:
+    b = payload.reshape(-1, 3).astype(np.int32)
+    ints = (b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)) << 8 >> 8
+    return (ints / _S24_SCALE).astype(np.float32)
+
+
+def parse_mpx_packet(data) -> Tuple[int, int, int, int, np.ndarray]:
+    """(seq, sample_index, timestamp_ns, fs, float32 samples) of one packet; ValueError if malformed."""
+    if len(data) < _MPX_PACKET_HEADER.size:
+        raise ValueError("short packet")
+    magic, version, fmt, nframes, seq, index, stamp, fs = _MPX_PACKET_HEADER.unpack_from(data)
+    if magic != MPX_PACKET_MAGIC or version != MPX_PACKET_VERSION or fmt not in _MPX_SAMPLE_BYTES:
+        raise ValueError("not an MPX packet")
+    size = nframes * _MPX_SAMPLE_BYTES[fmt]
+    payload = np.frombuffer(data, dtype=np.uint8, count=size, offset=_MPX_PACKET_HEADER.size)
+    samples = payload.view('<f4').astype(np.float32) if fmt == 0 else _decode_s24(payload)
+    return seq, index, stamp, fs, samples
+
+
+class NetworkSink(ThreadedSink):
+    """Sends MPX as sequenced, timestamped packets over UDP or TCP (see MPX_PACKET_MAGIC).
+
+    Each packet carries the stream index of its first sample, so the receiver places it exactly
+    and treats blocks this sink dropped as a gap. Packets are assembled in one preallocated
+    buffer; a block costs one vectorized conversion and one send per packet.
+    """
+
+    RETRY_S = 2.0
+
+    def __init__(self, proto: str, host: str, port: int, fs: int, fmt: str = "f32",
+                 packet_frames: Optional[int] = None, max_blocks: int = 64):
+        if proto not in ("udp", "tcp"):
+            raise ValueError(f"unknown protocol {proto!r}")
+        if fmt not in MPX_PACKET_FORMATS:
+            raise ValueError(f"unknown sample format {fmt!r} (use f32 or s24)")
+        self.proto = proto
+        self.host = host
+        self.port = port
+        self.fs = fs
+        self.fmt = fmt
+        self.packet_frames = packet_frames or _MPX_DEFAULT_PACKET_FRAMES[fmt]
+        if not 0 < self.packet_frames <= 0xFFFF:
+            raise ValueError("packet frames must be 1..65535")
+        self.name = f"{proto}://{host}:{port}"
+        self.packets = 0
+        self._code = MPX_PACKET_FORMATS[fmt]
+        width = _MPX_SAMPLE_BYTES[self._code]
+        self._packet = bytearray(_MPX_PACKET_HEADER.size + self.packet_frames * width)
+        self._packet_bytes = np.frombuffer(self._packet, dtype=np.uint8)
+        self._seq = 0
+        self._sock: Optional[socket.socket] = None
+        self._next_try = 0.0
+        super().__init__(max_blocks)
+
+    def _connect(self):
+        if self.proto == "udp":
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.connect((self.host, self.port))
+        else:
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.RETRY_S)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _consume(self, block: np.ndarray, start: int) -> bool:
+        if self._sock is None:
+            if time.monotonic() < self._next_try:
+                return False
+            self._next_try = time.monotonic() + self.RETRY_S
+            self._connect()
+        if self._code == 0:
+            payload = np.frombuffer(_pcm_bytes(block), dtype=np.uint8)
+        else:
+            payload = _encode_s24(block).reshape(-1)
+        width = _MPX_SAMPLE_BYTES[self._code]
+        packet, packet_bytes, view = self._packet, self._packet_bytes, memoryview(self._packet)
+        head = _MPX_PACKET_HEADER.size
+        stamp = time.time_ns()
+        try:
+            for offset in range(0, len(block), self.packet_frames):
+                n = min(self.packet_frames, len(block) - offset)
+                _MPX_PACKET_HEADER.pack_into(packet, 0, MPX_PACKET_MAGIC, MPX_PACKET_VERSION, self._code, n,
+                                             self._seq & 0xFFFFFFFF, start + offset, stamp, int(self.fs))
+                packet_bytes[head:head + n * width] = payload[offset * width:(offset + n) * width]
+                self._sock.sendall(view[:head + n * width])
+                self._seq += 1
+                self.packets += 1
+        except OSError:
+            if self.proto == "tcp":
+                self._sock.close()
+                self._sock = None
+            raise
+        return True
+
+    def _finish(self):
+        if self._sock is not None:
+            self._sock.close()
+
+
+class MpxReceiver:
+    """Receives NetworkSink packets into a jitter buffer that an output callback reads from.
+
+    Packets are placed by their sample index, so reordering within the buffer is harmless.
+    Playout starts once jitter_ms is buffered. Counters: packets received, lost (sequence
+    gaps never filled), late (arrived after their playout time), missing_frames (played as
+    silence) and rebuffers. A stall that drains the buffer re-primes it, skipping the gap.
+    """
+
+    def __init__(self, proto: str, host: str, port: int, fs: int, jitter_ms: float = 50.0):
+        if proto not in ("udp", "tcp"):
+            raise ValueError(f"unknown protocol {proto!r}")
+        self.proto = proto
+        self.fs = fs
+        self.jitter_frames = max(1, int(jitter_ms * fs / 1000.0))
+        self.capacity = max(4 * self.jitter_frames, int(fs))
+        self._buf = np.zeros(self.capacity, dtype=np.float32)
+        self._valid = np.zeros(self.capacity, dtype=bool)
+        self._lock = threading.Lock()
+        self._play_pos: Optional[int] = None
+        self._high = 0
+        self._primed = False
+        self._next_seq: Optional[int] = None
+        self.packets = 0
+        self.lost = 0
+        self.late = 0
+        self.bad = 0
+        self.missing_frames = 0
+        self.rebuffers = 0
+        self.transit_ms = 0.0
+        if proto == "udp":
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        else:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        if proto == "tcp":
+            self._sock.listen(1)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._sock.getsockname()[:2]
+
+    @property
+    def buffered_frames(self) -> int:
+        return max(0, self._high - self._play_pos) if self._play_pos is not None else 0
+
+    def start(self) -> "MpxReceiver":
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed = True
+        self._sock.close()
+
+    def _run(self):
+        try:
+            if self.proto == "udp":
+                while not self._closed:
+                    data = self._sock.recv(65536)
+                    self._packet(data)
+            else:
+                while not self._closed:
+                    conn, _ = self._sock.accept()
+                    with conn, conn.makefile("rb") as stream:
+                        while True:
+                            head = stream.read(_MPX_PACKET_HEADER.size)
+                            if len(head) < _MPX_PACKET_HEADER.size:
+                                break
+                            fmt, nframes = _MPX_PACKET_HEADER.unpack(head)[2:4]
+                            body = stream.read(nframes * _MPX_SAMPLE_BYTES.get(fmt, 0))
+                            self._packet(head + body)
+        except OSError:
+            if not self._closed:
+                raise
+
+    def _packet(self, data):
+        try:
+            seq, index, stamp, fs, samples = parse_mpx_packet(data)
+        except ValueError:
+            self.bad += 1
+            return
+        if fs != self.fs:
+            self.bad += 1
+            return
+        self.packets += 1
+        self.transit_ms = (time.time_ns() - stamp) / 1e6
+        if self._next_seq is not None:
+            gap = (seq - self._next_seq) & 0xFFFFFFFF
+            if gap < 0x80000000:
+                self.lost += gap
+                self._next_seq = (seq + 1) & 0xFFFFFFFF
+            elif self.lost:
+                self.lost -= 1  # a reordered packet filling an earlier gap
+        else:
+            self._next_seq = (seq + 1) & 0xFFFFFFFF
+        self._put(index, samples)
+
+    def _put(self, index: int, samples: np.ndarray):
+        cap = self.capacity
+        with self._lock:
+            if self._play_pos is None or index >= self._play_pos + cap or index + cap < self._play_pos:
+                # First packet, or the sender restarted or jumped: start over from here
+                self._play_pos, self._high, self._primed = index, index, False
+                self._valid[:] = False
+            elif not self._primed and self._high <= self._play_pos < index:
+                # Re-priming after a stall: skip the gap rather than add it to the latency
+                self._play_pos = self._high = index
+            if index + len(samples) <= self._play_pos:
+                self.late += 1
+                return
+            if index < self._play_pos:
+                self.late += 1
+                samples = samples[self._play_pos - index:]
+                index = self._play_pos
+            n = min(len(samples), self._play_pos + cap - index)
+            pos = index % cap
+            first = min(n, cap - pos)
+            self._buf[pos:pos + first] = samples[:first]
+            self._buf[:n - first] = samples[first:n]
+            self._valid[pos:pos + first] = True
+            self._valid[:n - first] = True
+            self._high = max(self._high, index + n)
+            if not self._primed and self._high - self._play_pos >= self.jitter_frames:
+                self._primed = True
+
+    def read_into(self, out: np.ndarray):
+        """Fill out with the next frames of the stream; silence while priming or for lost samples."""
+        frames = len(out)
+        with self._lock:
+            if not self._primed:
+                out[:] = 0
+                return
+            cap, pos = self.capacity, self._play_pos % self.capacity
+            first = min(frames, cap - pos)
+            for dst, src in ((out[:first], slice(pos, pos + first)), (out[first:], slice(0, frames - first))):
+                valid = self._valid[src]
+                dst[:] = self._buf[src]
+                dst[~valid] = 0
+                self.missing_frames += len(valid) - int(np.count_nonzero(valid))
+                self._valid[src] = False
+            self._play_pos += frames
+            if self._high <= self._play_pos:
+                self._primed = False
+                self.rebuffers += 1
+
+    def callback(self, outdata, frames, time_info, status):
+        """sounddevice output callback playing the stream on every channel."""
+        self.read_into(outdata[:, 0])
+        if outdata.shape[1] > 1:
+            outdata[:, 1:] = outdata[:, :1]
+
+    def summary(self) -> str:
+        return (f"buffered {1e3 * self.buffered_frames / self.fs:6.1f} ms | packets {self.packets} lost {self.lost}"
+                f" late {self.late} bad {self.bad} | missing {self.missing_frames} frames, rebuffers {self.rebuffers}"
+                f" | transit {self.transit_ms:.1f} ms")
+
+
+# =============================
+# Live metrics
+# =============================
+
+# Upper edges (seconds) of the block-latency histogram buckets; a last +Inf bucket catches the rest
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+
+
+def _prometheus_label(name: str, value) -> str:
+    """{name="value"} with the backslashes, quotes and newlines the text format requires escaped."""
+    text = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'{{{name}="{text}"}}'
+
+
+class PipelineMetrics:
+    """Counters and gauges for a running pipeline, cheap enough to update on every block.
+
+    The producer calls observe_block() once per rendered block (a bisect and a min/max); ring fill,
+    underruns, RDS group counts and the engine's per-stage times are read from the live objects
+    only when a snapshot is taken, so scraping never touches the audio path.
+    """
+
+    def __init__(self, fs: float, engine: Optional[MpxEngine] = None, ring: Optional[AudioRingBuffer] = None,
+                 gen: Optional[RdsBitstreamGenerator] = None, capture_queue: Optional[queue.Queue] = None,
+                 sinks: Sequence[MpxSink] = (), carousel: Optional[Rds2FileCarousel] = None):
+        self.fs = fs
+        self.carousel = carousel
+        self.sinks = list(sinks)
+        self.engine = engine
+        self.ring = ring
+        self.gen = gen
+        self.capture_queue = capture_queue
+        # Set in capture mode when the capture clock is locked to the device's
+        self.drift: Optional[ClockDriftController] = None
+        self.started = time.monotonic()
+        self.blocks = 0
+        self.frames = 0
+        self.source_seconds = 0.0
+        self.capture_drops = 0
+        self.mpx_peak = 0.0
+        self.mpx_peak_max = 0.0
+        self.latency_max = 0.0
+        self._latency_sum = 0.0
+        self._latency_counts = [0] * (len(LATENCY_BUCKETS_S) + 1)
+
+    def observe_block(self, seconds: float, mpx: np.ndarray, source_seconds: float = 0.0):
+        """Record one rendered block: its render time, the time spent fetching its input, and its peak."""
+        self._latency_counts[bisect.bisect_left(LATENCY_BUCKETS_S, seconds)] += 1
+        self._latency_sum += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        self.source_seconds += source_seconds
+        self.blocks += 1
+        self.frames += len(mpx)
+        if len(mpx):
+            self.mpx_peak = peak = max(float(mpx.max()), -float(mpx.min()))
+            self.mpx_peak_max = max(self.mpx_peak_max, peak)
+
+    def snapshot(self) -> dict:
+        stages = {"source": self.source_seconds}
+        if self.engine is not None:
+            stages.update(self.engine.stage_seconds)
+        counts = list(self._latency_counts)
+        cumulative = np.cumsum(counts).tolist()
+        ring = self.ring
+        return {
+            "uptime_seconds": time.monotonic() - self.started,
+            "fs": self.fs,
+            "blocks": self.blocks,
+            "audio_seconds": self.frames / self.fs,
+            "stage_seconds": stages,
+            "block_latency_seconds": {
+                "buckets": {**{f"{le:g}": c for le, c in zip(LATENCY_BUCKETS_S, cumulative)}, "+Inf": cumulative[-1]},
+                "sum": self._latency_sum,
+                "count": cumulative[-1],
+                "max": self.latency_max,
+            },
+            "queue_depth_frames": ring.available if ring is not None else 0,
+            "queue_capacity_frames": ring.capacity if ring is not None else 0,
+            "capture_queue_blocks": self.capture_queue.qsize() if self.capture_queue is not None else 0,
+            "underruns": ring.underruns if ring is not None else 0,
+            "overruns": ring.overruns if ring is not None else 0,
+            "capture_drops": self.capture_drops,
+            "clock_drift_ppm": self.drift.drift_ppm if self.drift is not None else 0.0,
+            "resample_ratio": self.drift.ratio if self.drift is not None else 1.0,
+            "rds_groups": dict(self.gen.group_counts) if self.gen is not None else {},
+            "rds2_file_groups": dict(self.carousel.group_counts) if self.carousel is not None else {},
+            "sinks": {s.name: {"frames": s.frames, "dropped": s.dropped, "queued": s.queued, "errors": s.errors}
+                      for s in self.sinks},
+            "mpx_peak": self.mpx_peak,
+            "mpx_peak_max": self.mpx_peak_max,
+        }
+
+    def prometheus(self, prefix: str = "jmpx") -> str:
+        """The snapshot in Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help_text: str, samples: Sequence[Tuple[str, float]]):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for suffix_labels, value in samples:
+                lines.append(f"{prefix}_{name}{suffix_labels} {value:.9g}")
+
+        metric("uptime_seconds", "gauge", "Seconds since the pipeline started", [("", snap["uptime_seconds"])])
+        metric("blocks_total", "counter", "MPX blocks rendered", [("", snap["blocks"])])
+        metric("audio_seconds_total", "counter", "Seconds of MPX rendered", [("", snap["audio_seconds"])])
+        metric("stage_seconds_total", "counter", "Wall-clock seconds spent per pipeline stage",
+               [(_prometheus_label("stage", k), v) for k, v in snap["stage_seconds"].items()])
+        hist = snap["block_latency_seconds"]
+        metric("block_latency_seconds", "histogram", "Time to render one MPX block",
+               [("_bucket" + _prometheus_label("le", le), c) for le, c in hist["buckets"].items()]
+               + [("_sum", hist["sum"]), ("_count", hist["count"])])
+        metric("queue_depth_frames", "gauge", "MPX frames buffered ahead of the output device",
+               [("", snap["queue_depth_frames"])])
+        metric("queue_capacity_frames", "gauge", "Output ring capacity", [("", snap["queue_capacity_frames"])])
+        metric("capture_queue_blocks", "gauge", "Captured blocks waiting for the producer",
+               [("", snap["capture_queue_blocks"])])
+        metric("underruns_total", "counter", "Device callbacks that found too little MPX buffered",
+               [("", snap["underruns"])])
+        metric("overruns_total", "counter", "MPX blocks that did not fit in the output ring", [("", snap["overruns"])])
+        metric("capture_drops_total", "counter", "Captured blocks dropped because the producer fell behind",
+               [("", snap["capture_drops"])])
+        metric("clock_drift_ppm", "gauge", "Measured capture clock drift against the output device (ppm)",
+               [("", snap["clock_drift_ppm"])])
+        metric("resample_ratio", "gauge", "Current capture resampling ratio (output/input samples)",
+               [("", snap["resample_ratio"])])
+        metric("rds_groups_total", "counter", "RDS groups started, by type",
+               [(_prometheus_label("type", k), v) for k, v in snap["rds_groups"].items()])
+        metric("rds2_file_groups_total", "counter", "RDS2 file carousel groups sent, by slot",
+               [(_prometheus_label("slot", k), v) for k, v in snap["rds2_file_groups"].items()])
+        sinks = snap["sinks"].items()
+        metric("sink_frames_total", "counter", "MPX frames delivered, by sink",
+               [(_prometheus_label("sink", k), v["frames"]) for k, v in sinks])
+        metric("sink_dropped_blocks_total", "counter", "Blocks a sink dropped because it fell behind or failed",
+               [(_prometheus_label("sink", k), v["dropped"]) for k, v in sinks])
+        metric("sink_queued", "gauge", "Blocks (frames for the device) waiting in each sink",
+               [(_prometheus_label("sink", k), v["queued"]) for k, v in sinks])
+        metric("mpx_peak", "gauge", "Peak absolute MPX level of the last block", [("", snap["mpx_peak"])])
+        metric("mpx_peak_max", "gauge", "Peak absolute MPX level since start", [("", snap["mpx_peak_max"])])
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """One status line for the console."""
+        snap = self.snapshot()
+        blocks = max(snap["blocks"], 1)
+        stages = " ".join(f"{k} {1e3 * v / blocks:.2f}" for k, v in snap["stage_seconds"].items())
+        groups = " ".join(f"{k}={v}" for k, v in snap["rds_groups"].items())
+        fill = 100.0 * snap["queue_depth_frames"] / max(snap["queue_capacity_frames"], 1)
+        sink_drops = "".join(f" {k} {v['dropped']}" for k, v in snap["sinks"].items() if v["dropped"])
+        drift = f" | drift {snap['clock_drift_ppm']:+.1f} ppm" if self.drift is not None else ""
+        return (f"{snap['audio_seconds']:8.1f}s | ms/block: {stages} | max {1e3 * snap['block_latency_seconds']['max']:.2f} ms"
+                f" | ring {fill:3.0f}% | underruns {snap['underruns']} overruns {snap['overruns']}"
+                f" drops {snap['capture_drops']}{sink_drops}{drift} | peak {snap['mpx_peak']:.3f} | groups {groups}")
+
+
+# =============================
+# Live RDS control
+# =============================
+
+# Keys accepted for live RDS updates (web UI JSON, play's control socket) and the RdsConfig fields they set
+RDS_UPDATE_KEYS = {"pi": "pi_code", "pty": "pty", "tp": "tp", "ps": "program_service_name", "rt": "radiotext",
+                   "ptyn": "ptyn", "af": "af", "ct": "ct", "rt_plus": "rt_plus"}
+
+
+def parse_rds_update(update: dict) -> dict:
+    """RdsConfig field changes from a {"pi", "pty", "tp", "ps", "rt", "ptyn", "af", "ct", "rt_plus"} mapping;
+    PI may be hex text or an int, af a list of MHz (or "98.1,101.3") and rt_plus a list of
+    [content type, start, length]. Raises ValueError on unknown keys, values of the wrong type
+    or out-of-range values."""
+    if not isinstance(update, dict):
+        raise ValueError("expected a JSON object")
+    unknown = set(update) - set(RDS_UPDATE_KEYS)
+    if unknown:
+        raise ValueError(f"unknown key(s): {', '.join(sorted(unknown))}")
+    changes = {}
+    for key, value in update.items():
+        if key == "pi":
+            try:
+                value = int(value, 16) if isinstance(value, str) else int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"pi must be a hex code or an integer, not {value!r}")
+            if not 0 <= value <= 0xFFFF:
+                raise ValueError("pi must be 0x0000..0xFFFF")
+        elif key == "pty":
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"pty must be an integer, not {value!r}")
+            if not 0 <= value <= 31:
+                raise ValueError("pty must be 0..31")
+        elif key == "tp":
+            value = 1 if value else 0
+        elif key == "ct":
+            value = bool(value)
+        elif key == "af":
+            if isinstance(value, str):
+                value = parse_af_list(value)
+            else:
+                try:
+                    value = tuple(float(f) for f in value)
+                except (TypeError, ValueError):
+                    raise ValueError("af must be a list of frequencies in MHz or text like 98.1,101.3")
+            check_rds_config(RdsConfig(pi_code=0, af=value))
+        elif key == "rt_plus":
+            try:
+                value = tuple((int(t), int(s), int(n)) for t, s, n in value)
+            except (TypeError, ValueError):
+                raise ValueError("rt_plus must be a list of [content type, start, length]")
+            check_rds_config(RdsConfig(pi_code=0, rt_plus=value))
+        else:
+            if value is None:
+                raise ValueError(f"{key} must be text")
+            value = str(value)
+        changes[RDS_UPDATE_KEYS[key]] = value
+    return changes
+
+
+def rds_config_dict(cfg: RdsConfig) -> dict:
+    return {"pi": f"0x{cfg.pi_code & 0xFFFF:04X}", "pty": cfg.pty, "tp": bool(cfg.tp),
+            "ps": cfg.program_service_name, "rt": cfg.radiotext, "ptyn": cfg.ptyn, "af": list(cfg.af),
+            "ct": bool(cfg.ct), "rt_plus": [list(tag) for tag in cfg.rt_plus]}
+
+
+class _RdsControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        gen: RdsBitstreamGenerator = self.server.gen
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                cfg = gen.update_config(**parse_rds_update(json.loads(line)))
+                reply = {"ok": True, "config": rds_config_dict(cfg)}
+            except ValueError as e:
+                reply = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class RdsControlServer:
+    """Line-delimited JSON control socket that retunes a live RdsBitstreamGenerator.
+
+    Each request line is an object of changes, e.g. {"ps": "NEWNAME", "rt": "Now playing"}; the
+    reply line is {"ok": true, "config": {...}} or {"ok": false, "error": "..."}. Changes apply at
+    the next group boundary; audio and modulation are not touched. {} just reads the configuration.
+    """
+
+    def __init__(self, gen: RdsBitstreamGenerator, host: str = "127.0.0.1", port: int = 0):
+        self._server = socketserver.ThreadingTCPServer((host, port), _RdsControlHandler)
+        self._server.daemon_threads = True
+        self._server.gen = gen
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> "RdsControlServer":
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread.is_alive():
+            self._server.shutdown()
+        self._server.server_close()
+
+
 # =============================
 # CLI
 # =============================
@@ -426,6 +2837,74 @@ def devices(fs: int):
         click.echo(f"{idx:5d} | {dev['name']} | {dev.get('max_output_channels', 0)} | {dev.get('max_input_channels', 0)}")
 
 
+def _precision_dtype(precision: str):
+    return np.float64 if precision == "64" else np.float32
+
+
+def parse_rds2_file_spec(spec: str) -> Tuple[str, float]:
+    """Split an --rds2-file value, PATH[,share=WEIGHT], into (path, share)."""
+    path, _, opts = spec.partition(",")
+    share = 1.0
+    for opt in filter(None, opts.split(",")):
+        key, _, value = opt.partition("=")
+        if key != "share":
+            raise ValueError(f"unknown --rds2-file option {key!r} in {spec!r}")
+        share = float(value)
+    return path, share
+
+
+def build_rds2_carousel(logo: Optional[str] = None, files: Sequence[str] = (),
+                        logo_cache: Optional[str] = None) -> Optional[Rds2FileCarousel]:
+    """Carousel with the encoded logo in slot 0 and each PATH[,share=W] of files in the next slots;
+    None when there is nothing to send."""
+    if not logo and not files:
+        return None
+    carousel = Rds2FileCarousel()
+    slot = 0
+    if logo:
+        logo_bytes = np.packbits(load_logo_bits(logo, cache_dir=logo_cache)).tobytes()
+        carousel.set_file(slot, logo_bytes, name=os.path.basename(logo))
+        slot += 1
+    for spec in files:
+        path, share = parse_rds2_file_spec(spec)
+        with open(path, "rb") as f:
+            carousel.set_file(slot, f.read(), share=share, name=os.path.basename(path))
+        slot += 1
+    return carousel
+
+
+PREEMPHASIS_CHOICES = ("off", "50", "75")
+
+
+def _preemphasis_us(preemphasis: str) -> Optional[float]:
+    if preemphasis not in PREEMPHASIS_CHOICES:
+        raise ValueError(f"preemphasis must be one of {', '.join(PREEMPHASIS_CHOICES)}, got {preemphasis!r}")
+    return None if preemphasis == "off" else float(preemphasis)
+
+
+def _run_sinks(fanout: SinkFanout, metrics: PipelineMetrics, stats_interval: float):
+    """Start the sinks and block until they have delivered everything (or Ctrl-C), printing a
+    metrics line to stderr every stats_interval seconds; then release them and report losses."""
+    next_report = time.monotonic() + stats_interval
+    try:
+        fanout.start()
+        while not fanout.wait(0.1):
+            if stats_interval > 0 and time.monotonic() >= next_report:
+                next_report += stats_interval
+                click.echo(metrics.summary(), err=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fanout.stop()
+    ring = fanout.ring
+    if ring is not None:
+        click.echo(f"Underruns: {ring.underruns}, overruns: {ring.overruns}")
+    for sink in fanout.sinks:
+        if sink.dropped or sink.errors:
+            click.echo(f"{sink.name}: {sink.dropped} blocks dropped, {sink.errors} errors"
+                       + (f" (last: {sink.last_error})" if sink.last_error else ""), err=True)
+
+
 def _prepare_rds_bits(pi: int, ps: str, rt: str, seconds: float, fs: int) -> np.ndarray:
     cfg = RdsConfig(pi_code=pi, program_service_name=ps or "", radiotext=rt or "")
     gen = RdsBitstreamGenerator(cfg)
@@ -442,25 +2921,67 @@ def _prepare_rds_bits(pi: int, ps: str, rt: str, seconds: float, fs: int) -> np.
 @click.option("--device-name", type=str, default=None, help="Output device name (substring match)")
 @click.option("--system-audio", is_flag=True, default=False, help="Capture system audio via WASAPI loopback (Windows)")
 @click.option("--capture-name", type=str, default=None, help="Playback or input device name to capture from")
+@click.option("--drift-comp/--no-drift-comp", default=True, show_default=True,
+              help="In capture mode, resample the input to track clock drift between the capture and output devices")
 @click.option("--pi", type=str, default="0x1234", show_default=True, help="PI code, hex like 0x1234")
 @click.option("--ps", type=str, default="TESTFM", show_default=True, help="Program Service name (8 chars)")
 @click.option("--rt", type=str, default="", help="Radiotext (up to 64 chars)")
+@click.option("--ptyn", type=str, default="", help="Programme type name (8 chars, group 10A)")
+@click.option("--af", type=float, multiple=True, help="Alternative frequency in MHz; repeat for more (up to 25)")
+@click.option("--ct", is_flag=True, default=False, help="Send the clock time (group 4A, once a minute)")
+@click.option("--rt-plus", "rt_plus", type=str, multiple=True,
+              help="RadioText+ tag as TYPE,START,LENGTH into the radiotext; up to two")
+@click.option("--group-rates", type=str, default="",
+              help="RDS group rates per second over the defaults, e.g. 0A=4,2A=2,10A=1 (0 stops a type)")
 @click.option("--pilot-level", type=float, default=DEFAULT_PILOT_LEVEL, show_default=True, help="Pilot level (linear)")
 @click.option("--rds-level", type=float, default=DEFAULT_RDS_LEVEL, show_default=True, help="RDS level (linear)")
 @click.option("--rds2", is_flag=True, default=False, help="Enable experimental RDS2 sidebands")
 @click.option("--rds2-level", type=float, default=DEFAULT_RDS2_LEVEL, show_default=True, help="RDS2 per-subcarrier level (linear)")
 @click.option("--logo", type=click.Path(exists=True, dir_okay=False), default=None, help="Path to station logo image (png/jpg)")
+@click.option("--logo-cache", type=click.Path(file_okay=False), default=None,
+              help="Directory to keep encoded logos in, keyed by image content, for reuse across runs")
+@click.option("--rds2-file", "rds2_files", type=str, multiple=True,
+              help="File to cycle on the RDS2 carousel after the logo, as PATH[,share=WEIGHT]; repeat for more")
 @click.option("--level-mpx", type=float, default=0.0, show_default=True, help="Overall MPX gain (dB)")
+@click.option("--precision", type=click.Choice(["32", "64"]), default="32", show_default=True,
+              help="Float width of the MPX signal path (64 is a slower accuracy reference)")
+@click.option("--preemphasis", type=click.Choice(PREEMPHASIS_CHOICES), default="off", show_default=True,
+              help="FM pre-emphasis time constant in us (50 Europe, 75 Americas)")
+@click.option("--limiter", is_flag=True, default=False, help="Look-ahead limiter on L/R holding the stereo composite under the pilot/RDS headroom")
+@click.option("--clipper", is_flag=True, default=False,
+              help="Soft-clip the stereo composite into the headroom left by pilot and RDS, before injecting them")
+@click.option("--loop-cache", is_flag=True, default=False,
+              help="With --tone, render one period of the MPX once and replay it; live rendering resumes if RDS changes")
+@click.option("--loop-cache-file", type=click.Path(dir_okay=False), default=None,
+              help="Keep the --loop-cache loop memory-mapped in this .npy file instead of RAM (implies --loop-cache)")
 @click.option("--blocksize", type=int, default=4096, show_default=True, help="Block size for streaming frames")
+@click.option("--lookahead-ms", type=float, default=200.0, show_default=True, help="Rendered MPX kept buffered ahead of the device (ms)")
+@click.option("--stats-interval", type=float, default=0.0, show_default=True,
+              help="Print pipeline metrics to stderr every N seconds (0 disables)")
+@click.option("--control-port", type=int, default=None,
+              help="Accept live RDS updates as JSON lines on this localhost TCP port, e.g. {\"ps\": \"NEWNAME\"}")
+@click.option("--sink", "sink_specs", type=str, multiple=True,
+              help="Output for the rendered MPX; repeat to fan out. device | null | record:PATH[,segment=SECONDS] | "
+                   "pipe:PATH|- | socket:HOST:PORT | udp://HOST:PORT or tcp://HOST:PORT [,format=f32|s24][,frames=N], "
+                   "each optionally with ,queue=BLOCKS (default: device)")
 def play(input: Optional[str], tone: Optional[float], duration: float, fs: int, device: Optional[int], device_name: Optional[str],
-         system_audio: bool, capture_name: Optional[str], pi: str, ps: str,
-         rt: str, pilot_level: float, rds_level: float, rds2: bool, rds2_level: float, logo: Optional[str], level_mpx: float, blocksize: int):
+         system_audio: bool, capture_name: Optional[str], drift_comp: bool, pi: str, ps: str,
+         rt: str, ptyn: str, af: Tuple[float, ...], ct: bool, rt_plus: Tuple[str, ...], group_rates: str, pilot_level: float, rds_level: float, rds2: bool, rds2_level: float, logo: Optional[str],
+         logo_cache: Optional[str], rds2_files: Tuple[str, ...], level_mpx: float, precision: str, preemphasis: str,
+         limiter: bool, clipper: bool, loop_cache: bool, loop_cache_file: Optional[str], blocksize: int, lookahead_ms: float,
+         stats_interval: float, control_port: Optional[int], sink_specs: Tuple[str, ...]):
     """Play composite MPX with RDS/RDS2 to a sound device.
 
     Modes:
     - File/tone playback (default): provide --input or --tone
     - Capture: use --system-audio (Windows WASAPI loopback) and optionally --capture-name to pick playback device to loop back,
       or omit --system-audio and provide --capture-name to use a regular input device (e.g., microphone or VAC input).
+      The two devices run on separate clocks; unless --no-drift-comp is given, the captured audio is resampled
+      by a few ppm as needed to hold the output buffer at the lookahead.
+
+    Each block is rendered once and handed to every --sink, e.g. the device plus a rolling recorder.
+    With --tone and --loop-cache the signal is periodic, so one period is rendered up front and
+    replayed at next to no CPU cost until an RDS change (e.g. over --control-port) needs live rendering.
     """
     if input is None and tone is None and not (system_audio or capture_name):
         raise click.UsageError("Provide --input or --tone, or use --system-audio/--capture-name for live capture")
@@ -477,12 +2998,35 @@ def play(input: Optional[str], tone: Optional[float], duration: float, fs: int,
         sd.default.device = (sd.default.device[0] if isinstance(sd.default.device, (list, tuple)) else None, device)
 
     # Prepare RDS generator
-    cfg = RdsConfig(pi_code=int(pi, 16), program_service_name=ps or "", radiotext=rt or "")
-    gen = RdsBitstreamGenerator(cfg)
-    if rds2 and logo:
-        gen.set_logo_bits(load_logo_bits(logo))
+    try:
+        cfg = RdsConfig(pi_code=int(pi, 16), program_service_name=ps or "", radiotext=rt or "", ptyn=ptyn or "",
+                        af=tuple(af), ct=ct, rt_plus=tuple(parse_rt_plus_tag(tag) for tag in rt_plus))
+        check_rds_config(cfg)
+        gen = RdsBitstreamGenerator(cfg, rates=parse_group_rates(group_rates))
+    except ValueError as e:
+        raise click.UsageError(f"RDS: {e}")
+    try:
+        carousel = build_rds2_carousel(logo, rds2_files, logo_cache) if rds2 else None
+    except (OSError, ValueError) as e:
+        raise click.UsageError(f"RDS2 carousel: {e}")
+    control = RdsControlServer(gen, port=control_port).start() if control_port is not None else None
+    if control is not None:
+        click.echo(f"RDS control listening on {control.address[0]}:{control.address[1]}", err=True)
 
     gain = db_to_linear(level_mpx)
+    engine = MpxEngine(fs, gen, pilot_level=pilot_level, rds_level=rds_level, rds2_level=rds2_level,
+                       enable_rds2=rds2, dtype=_precision_dtype(precision), preemphasis_us=_preemphasis_us(preemphasis),
+                       limiter=limiter, clipper=clipper,
+                       rds2_gens=[carousel.stream() for _ in RDS2_SUBCARRIER_HZ] if carousel else None)
+
+    # Sinks; the device's ring holds the lookahead plus room for two more blocks
+    lookahead_frames = max(blocksize, int(lookahead_ms * fs / 1000.0))
+    try:
+        sinks = [open_sink(spec, fs, blocksize, lookahead_frames) for spec in sink_specs or ("device",)]
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    fanout = SinkFanout(sinks, fs, lookahead_frames)
+    metrics = PipelineMetrics(fs, engine=engine, ring=fanout.ring, gen=gen, sinks=sinks, carousel=carousel)
 
     # Capture mode
     if system_audio or capture_name:
@@ -514,7 +3058,7 @@ def play(input: Optional[str], tone: Optional[float], duration: float, fs: int,
                     raise click.UsageError(f"Input device not found: {capture_name}")
 
         q_in: "queue.Queue[np.ndarray]" = queue.Queue(maxsize=16)
-        q_out: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(maxsize=16)
+        metrics.capture_queue = q_in
 
         def in_callback(indata, frames, time_info, status):
             try:
@@ -522,7 +3066,7 @@ def play(input: Optional[str], tone: Optional[float], duration: float, fs: int,
                 data = indata if indata.shape[1] == 2 else np.repeat(indata, 2, axis=1)
                 q_in.put_nowait(data.copy())
             except queue.Full:
-                pass
+                metrics.capture_drops += 1
 
         def worker_stop_condition(start_time: float) -> bool:
             if tone is not None or input is not None:
@@ -531,130 +3075,155 @@ def play(input: Optional[str], tone: Optional[float], duration: float, fs: int,
                 return (time.time() - start_time) >= duration
             return False
 
+        # Lock the capture clock to the output device's: steer the ring's fill level to where
+        # priming leaves it by resampling the input. Without a device the capture sets the pace.
+        ring = fanout.ring
+        resampler: Optional[AdaptiveResampler] = None
+        if drift_comp and ring is not None:
+            resampler = AdaptiveResampler()
+            metrics.drift = ClockDriftController(max(blocksize, lookahead_frames - blocksize), fs)
+
         def worker():
             start_time = time.time()
-            while True:
-                if worker_stop_condition(start_time):
-                    q_out.put(None)
-                    return
-                try:
-                    stereo_block = q_in.get(timeout=0.5)
-                except queue.Empty:
-                    continue
-                # Bits needed for this block
-                frames = stereo_block.shape[0]
-                bits_needed = int(math.ceil(frames / fs * RDS_BITRATE)) + 208
-                bits_block = gen.generate_bits(bits_needed)
-                mpx = make_mpx(
-                    left=stereo_block[:, 0],
-                    right=stereo_block[:, 1],
-                    fs=fs,
-                    pilot_level=pilot_level,
-                    rds_level=rds_level,
-                    rds2_level=rds2_level,
-                    rds_bits=bits_block,
-                    enable_rds2=rds2,
-                )
-                mpx *= gain
-                q_out.put(mpx, block=True)
-
-        def out_callback(outdata, frames, time_info, status):
             try:
-                chunk = q_out.get(timeout=1.0)
-            except queue.Empty:
-                outdata[:] = 0
-                return
-            if chunk is None:
-                raise sd.CallbackStop
-            if outdata.shape[1] == 1:
-                outdata[:, 0] = chunk[:frames] if len(chunk) >= frames else np.pad(chunk, (0, frames - len(chunk)))
-            else:
-                mono = chunk[:frames] if len(chunk) >= frames else np.pad(chunk, (0, frames - len(chunk)))
-                outdata[:, 0] = mono
-                outdata[:, 1] = mono
+                while not worker_stop_condition(start_time):
+                    try:
+                        stereo_block = q_in.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    t0 = time.perf_counter()
+                    if resampler is not None:
+                        # Priming fills the ring from empty; steer only once the device is playing
+                        if ring.playing:
+                            resampler.ratio = metrics.drift.update(ring.latency_frames(fs), len(stereo_block) / fs)
+                        stereo_block = resampler.process(stereo_block)
+                    mpx = engine.process(stereo_block[:, 0], stereo_block[:, 1])
+                    mpx *= gain
+                    metrics.observe_block(time.perf_counter() - t0, mpx)
+                    # Capture paces the producer; a full ring drops the excess and counts an overrun
+                    fanout.write(mpx, pace=False)
+            finally:
+                fanout.close()
 
-        import threading
         worker_thread = threading.Thread(target=worker, daemon=True)
         worker_thread.start()
 
         with sd.InputStream(device=cap_idx, channels=2, dtype='float32', callback=in_callback,
-                             blocksize=blocksize, samplerate=fs, extra_settings=extra_settings), \
-             sd.OutputStream(channels=1, dtype='float32', callback=out_callback, blocksize=blocksize, samplerate=fs):
+                             blocksize=blocksize, samplerate=fs, extra_settings=extra_settings):
+            _run_sinks(fanout, metrics, stats_interval)
+        if control is not None:
+            control.close()
+        return
+
+    # Looped tone: render one period once, then replay it
+    if tone is not None and not input and (loop_cache or loop_cache_file):
+        stereo = tone_period(fs, tone)
+        try:
+            loop = render_mpx_loop(engine, stereo, carousel=carousel.copy() if carousel else None,
+                                   path=loop_cache_file)
+            click.echo(f"Loop cache: {len(loop.program) / fs:.3f}s program, {len(loop.rds) / fs:.1f}s RDS, "
+                       f"{loop.nbytes / 1e6:.1f} MB", err=True)
+        except ValueError as e:
+            click.echo(f"Loop cache off: {e}", err=True)
+            loop = None
+        program = LoopedProgram(stereo, engine, loop, carousel)
+
+        def loop_producer():
+            remaining = int(duration * fs)
             try:
-                while worker_thread.is_alive():
-                    time.sleep(0.1)
-            except KeyboardInterrupt:
-                pass
+                while remaining > 0:
+                    t0 = time.perf_counter()
+                    mpx = program.read(min(blocksize, remaining))
+                    mpx *= gain
+                    metrics.observe_block(time.perf_counter() - t0, mpx)
+                    fanout.write(mpx)
+                    remaining -= len(mpx)
+            finally:
+                # End the sinks even if rendering fails, so the device does not wait forever
+                fanout.close()
+
+        threading.Thread(target=loop_producer, daemon=True).start()
+        _run_sinks(fanout, metrics, stats_interval)
+        if control is not None:
+            control.close()
         return
 
-    # File/tone playback mode (original)
+    # File/tone playback mode (original). Blocks are decoded and resampled as they are needed,
+    # so playback starts without waiting for the whole file.
     if input:
-        stereo, _ = read_audio_file(input, target_fs=fs)
+        blocks = iter_audio_blocks(input, target_fs=fs, block_frames=blocksize)
     else:
-        stereo = generate_tone(duration_s=duration, fs=fs, freq_hz=tone or 1000.0)
-
-    total_seconds = stereo.shape[0] / fs
-
-    rds_bits = gen.generate_bits(int(math.ceil(total_seconds * RDS_BITRATE * 1.1)))
-
-    # Streaming in blocks
-    q_out: "queue.Queue[np.ndarray]" = queue.Queue(maxsize=8)
+        blocks = iter_tone_blocks(duration_s=duration, fs=fs, block_frames=blocksize, freq_hz=tone or 1000.0)
 
     def producer():
-        idx = 0
-        while idx < stereo.shape[0]:
-            end = min(idx + blocksize, stereo.shape[0])
-            left = stereo[idx:end, 0]
-            right = stereo[idx:end, 1]
-            # bits for this block (approx)
-            bits_needed = int(math.ceil((end - idx) / fs * RDS_BITRATE)) + 208
-            if len(rds_bits) < bits_needed:
-                # extend
-                extra = gen.generate_bits(int(math.ceil(2.0 * RDS_BITRATE)))
-                rds_bits[:] = np.concatenate([rds_bits, extra])
-            bits_block = rds_bits[:bits_needed]
-            rds_bits[:] = rds_bits[bits_needed:]
-
-            mpx = make_mpx(
-                left=left,
-                right=right,
-                fs=fs,
-                pilot_level=pilot_level,
-                rds_level=rds_level,
-                rds2_level=rds2_level,
-                rds_bits=bits_block,
-                enable_rds2=rds2,
-            )
-            mpx *= gain
-            q_out.put(mpx, block=True)
-            idx = end
-        # signal end
-        q_out.put(None)
-
-    def callback(outdata, frames, time_info, status):
+        source = iter(blocks)
         try:
-            chunk = q_out.get(timeout=1.0)
-        except queue.Empty:
-            outdata[:] = 0
-            return
-        if chunk is None:
-            raise sd.CallbackStop
-        # outdata is 2D (frames, channels). We output mono MPX to 1 ch; if device requires stereo, duplicate.
-        if outdata.shape[1] == 1:
-            outdata[:, 0] = chunk[:frames] if len(chunk) >= frames else np.pad(chunk, (0, frames - len(chunk)))
-        else:
-            mono = chunk[:frames] if len(chunk) >= frames else np.pad(chunk, (0, frames - len(chunk)))
-            outdata[:, 0] = mono
-            outdata[:, 1] = mono
+            while True:
+                t0 = time.perf_counter()
+                stereo = next(source, None)
+                if stereo is None:
+                    break
+                t1 = time.perf_counter()
+                mpx = engine.process(stereo[:, 0], stereo[:, 1])
+                mpx *= gain
+                metrics.observe_block(time.perf_counter() - t1, mpx, source_seconds=t1 - t0)
+                fanout.write(mpx)
+        finally:
+            # signal end, also when decoding or rendering fails
+            fanout.close()
 
-    # Run
-    import threading
+    # Run; the device starts once the lookahead is primed
     prod_thread = threading.Thread(target=producer, daemon=True)
     prod_thread.start()
+    _run_sinks(fanout, metrics, stats_interval)
+    if control is not None:
+        control.close()
+
+
+def render_mpx_file(output: str, input: Optional[str] = None, tone: Optional[float] = None, duration: float = 30.0,
+                    fs: int = 192000, pi: str = "0x1234", ps: str = "TESTFM", rt: str = "", ptyn: str = "",
+                    af: Sequence[float] = (), ct: bool = False, rt_plus: Sequence[Tuple[int, int, int]] = (),
+                    group_rates: str = "", pilot_level: float = DEFAULT_PILOT_LEVEL, rds_level: float = DEFAULT_RDS_LEVEL, rds2: bool = False,
+                    rds2_level: float = DEFAULT_RDS2_LEVEL, logo: Optional[str] = None, logo_cache: Optional[str] = None,
+                    rds2_files: Sequence[str] = (), level_mpx: float = 0.0,
+                    precision: str = "32", preemphasis: str = "off", limiter: bool = False, clipper: bool = False,
+                    chunk_seconds: float = 1.0, progress=None) -> int:
+    """Render an input file (or a tone) to a mono 24-bit MPX WAV one chunk at a time; returns frames written.
+
+    progress(written_frames, total_frames), if given, is called after every chunk.
+    """
+    if input is None and tone is None:
+        raise ValueError("need an input file or a tone")
+    chunk_frames = max(1, int(round(chunk_seconds * fs)))
+    if input:
+        info = sf.info(input)
+        total_frames = int(math.ceil(info.frames * fs / info.samplerate))
+        blocks = iter_audio_blocks(input, target_fs=fs, block_frames=chunk_frames)
+    else:
+        total_frames = int(duration * fs)
+        blocks = iter_tone_blocks(duration_s=duration, fs=fs, block_frames=chunk_frames, freq_hz=tone or 1000.0)
+
+    cfg = RdsConfig(pi_code=int(pi, 16), program_service_name=ps or "", radiotext=rt or "", ptyn=ptyn or "",
+                    af=tuple(af), ct=ct, rt_plus=tuple(tuple(tag) for tag in rt_plus))
+    gen = RdsBitstreamGenerator(cfg, rates=parse_group_rates(group_rates))
+    carousel = build_rds2_carousel(logo, rds2_files, logo_cache) if rds2 else None
+
+    engine = MpxEngine(fs, gen, pilot_level=pilot_level, rds_level=rds_level, rds2_level=rds2_level,
+                       enable_rds2=rds2, dtype=_precision_dtype(precision), preemphasis_us=_preemphasis_us(preemphasis),
+                       limiter=limiter, clipper=clipper,
+                       rds2_gens=[carousel.stream() for _ in RDS2_SUBCARRIER_HZ] if carousel else None)
+    gain = db_to_linear(level_mpx)
 
-    with sd.OutputStream(channels=1, dtype='float32', callback=callback, blocksize=blocksize, samplerate=fs):
-        while prod_thread.is_alive():
-            time.sleep(0.1)
+    written = 0
+    with sf.SoundFile(output, 'w', samplerate=fs, channels=1, subtype='PCM_24') as out:
+        for stereo in blocks:
+            mpx = engine.process(stereo[:, 0], stereo[:, 1])
+            mpx *= gain
+            out.write(mpx)
+            written += len(mpx)
+            if progress is not None:
+                progress(written, total_frames)
+    return written
 
 
 @cli.command()
@@ -666,105 +3235,612 @@ def play(input: Optional[str], tone: Optional[float], duration: float, fs: int,
 @click.option("--pi", type=str, default="0x1234", show_default=True, help="PI code, hex like 0x1234")
 @click.option("--ps", type=str, default="TESTFM", show_default=True, help="Program Service name (8 chars)")
 @click.option("--rt", type=str, default="", help="Radiotext (up to 64 chars)")
+@click.option("--ptyn", type=str, default="", help="Programme type name (8 chars, group 10A)")
+@click.option("--af", type=float, multiple=True, help="Alternative frequency in MHz; repeat for more (up to 25)")
+@click.option("--ct", is_flag=True, default=False, help="Send the clock time (group 4A, once a minute)")
+@click.option("--rt-plus", "rt_plus", type=str, multiple=True,
+              help="RadioText+ tag as TYPE,START,LENGTH into the radiotext; up to two")
+@click.option("--group-rates", type=str, default="",
+              help="RDS group rates per second over the defaults, e.g. 0A=4,2A=2,10A=1 (0 stops a type)")
 @click.option("--pilot-level", type=float, default=DEFAULT_PILOT_LEVEL, show_default=True, help="Pilot level (linear)")
 @click.option("--rds-level", type=float, default=DEFAULT_RDS_LEVEL, show_default=True, help="RDS level (linear)")
 @click.option("--rds2", is_flag=True, default=False, help="Enable experimental RDS2 sidebands")
 @click.option("--rds2-level", type=float, default=DEFAULT_RDS2_LEVEL, show_default=True, help="RDS2 per-subcarrier level (linear)")
 @click.option("--logo", type=click.Path(exists=True, dir_okay=False), default=None, help="Path to station logo image (png/jpg)")
+@click.option("--logo-cache", type=click.Path(file_okay=False), default=None,
+              help="Directory to keep encoded logos in, keyed by image content, for reuse across runs")
+@click.option("--rds2-file", "rds2_files", type=str, multiple=True,
+              help="File to cycle on the RDS2 carousel after the logo, as PATH[,share=WEIGHT]; repeat for more")
 @click.option("--level-mpx", type=float, default=0.0, show_default=True, help="Overall MPX gain (dB)")
+@click.option("--precision", type=click.Choice(["32", "64"]), default="32", show_default=True,
+              help="Float width of the MPX signal path (64 is a slower accuracy reference)")
+@click.option("--preemphasis", type=click.Choice(PREEMPHASIS_CHOICES), default="off", show_default=True,
+              help="FM pre-emphasis time constant in us (50 Europe, 75 Americas)")
+@click.option("--limiter", is_flag=True, default=False, help="Look-ahead limiter on L/R holding the stereo composite under the pilot/RDS headroom")
+@click.option("--clipper", is_flag=True, default=False,
+              help="Soft-clip the stereo composite into the headroom left by pilot and RDS, before injecting them")
+@click.option("--chunk-seconds", type=float, default=1.0, show_default=True, help="Audio rendered and written per chunk (s)")
 def tofile(output: str, input: Optional[str], tone: Optional[float], duration: float, fs: int, pi: str, ps: str, rt: str,
-           pilot_level: float, rds_level: float, rds2: bool, rds2_level: float, logo: Optional[str], level_mpx: float):
-    """Render composite MPX with RDS/RDS2 to a WAV file (mono)."""
+           ptyn: str, af: Tuple[float, ...], ct: bool, rt_plus: Tuple[str, ...], group_rates: str, pilot_level: float, rds_level: float, rds2: bool, rds2_level: float, logo: Optional[str],
+           logo_cache: Optional[str], rds2_files: Tuple[str, ...], level_mpx: float, precision: str, preemphasis: str, limiter: bool, clipper: bool,
+           chunk_seconds: float):
+    """Render composite MPX with RDS/RDS2 to a WAV file (mono).
+
+    Input is read, modulated and written one chunk at a time, so memory use does not grow with duration.
+    """
     if input is None and tone is None:
         raise click.UsageError("Provide --input or --tone")
+    if chunk_seconds <= 0:
+        raise click.UsageError("--chunk-seconds must be positive")
+    for spec in rds2_files:
+        try:
+            path, _ = parse_rds2_file_spec(spec)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        if not os.path.isfile(path):
+            raise click.UsageError(f"--rds2-file not found: {path}")
+    try:
+        tags = tuple(parse_rt_plus_tag(tag) for tag in rt_plus)
+        cfg = RdsConfig(pi_code=0, ptyn=ptyn or "", af=tuple(af), ct=ct, rt_plus=tags)
+        check_rds_config(cfg)
+        # Building a generator also checks that the group rates leave something to schedule
+        RdsBitstreamGenerator(cfg, rates=parse_group_rates(group_rates))
+    except ValueError as e:
+        raise click.UsageError(f"RDS: {e}")
+
+    start = time.perf_counter()
+    last_report = start
+
+    def progress(written: int, total_frames: int):
+        nonlocal last_report
+        now = time.perf_counter()
+        if now - last_report >= 1.0:
+            last_report = now
+            pct = 100.0 * written / total_frames if total_frames else 100.0
+            click.echo(f"\r{written / fs:8.1f}s rendered ({pct:5.1f}%), {written / fs / (now - start):6.1f}x realtime",
+                       err=True, nl=False)
+
+    written = render_mpx_file(output, input=input, tone=tone, duration=duration, fs=fs, pi=pi, ps=ps, rt=rt,
+                              ptyn=ptyn, af=af, ct=ct, rt_plus=tags, group_rates=group_rates,
+                              pilot_level=pilot_level, rds_level=rds_level, rds2=rds2, rds2_level=rds2_level,
+                              logo=logo, logo_cache=logo_cache, rds2_files=rds2_files, level_mpx=level_mpx,
+                              precision=precision, preemphasis=preemphasis, limiter=limiter, clipper=clipper,
+                              chunk_seconds=chunk_seconds, progress=progress)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    if last_report != start:
+        click.echo(err=True)
+    click.echo(f"Wrote {output} ({written/fs:.2f}s at {fs} Hz, {written / fs / elapsed:.1f}x realtime)")
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("1", "true", "yes", "on"):
+        return True
+    if text in ("0", "false", "no", "off", ""):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+# Manifest columns/keys and how to parse them; anything not given falls back to the batch defaults
+def _parse_preemphasis(value) -> str:
+    text = f"{value:g}" if isinstance(value, (int, float)) else str(value).strip().lower()
+    _preemphasis_us(text)
+    return text
+
+
+def _parse_group_rates(value) -> str:
+    parse_group_rates(str(value))
+    return str(value)
+
+
+BATCH_FIELDS = {
+    "output": str, "input": str, "tone": float, "duration": float, "fs": int,
+    "pi": str, "ps": str, "rt": str, "ptyn": str, "af": parse_af_list, "ct": _parse_bool,
+    "group_rates": _parse_group_rates, "pilot_level": float, "rds_level": float,
+    "rds2": _parse_bool, "rds2_level": float, "logo": str, "level_mpx": float,
+    "preemphasis": _parse_preemphasis, "limiter": _parse_bool, "clipper": _parse_bool,
+}
+_BATCH_PATHS = ("output", "input", "logo")
+
+
+def load_batch_manifest(path: str) -> List[dict]:
+    """Read a batch manifest: a CSV with a header row, or a JSON list of objects (or {"jobs": [...]}).
+
+    Returns one raw dict per job; empty CSV cells count as not given.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".json"):
+            data = json.load(f)
+            jobs = data.get("jobs", []) if isinstance(data, dict) else data
+        else:
+            jobs = [{k.strip(): v for k, v in row.items() if k and v is not None and v.strip() != ""}
+                    for row in csv.DictReader(f)]
+    if not isinstance(jobs, list) or not all(isinstance(job, dict) for job in jobs):
+        raise ValueError("manifest must be a list of job objects")
+    return jobs
+
+
+def _batch_job_kwargs(raw: dict, defaults: dict, base_dir: str) -> dict:
+    """render_mpx_file keyword arguments for one manifest entry; raises ValueError on a bad entry."""
+    unknown = set(raw) - set(BATCH_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(sorted(unknown))}")
+    kwargs = dict(defaults)
+    for key, value in raw.items():
+        kwargs[key] = BATCH_FIELDS[key](value)
+    if not kwargs.get("output"):
+        raise ValueError("missing output")
+    if kwargs.get("input") is None and kwargs.get("tone") is None:
+        raise ValueError("needs input or tone")
+    for key in _BATCH_PATHS:
+        if kwargs.get(key):
+            kwargs[key] = os.path.join(base_dir, os.path.expanduser(kwargs[key]))
+    return kwargs
+
+
+def _batch_worker_init(rates: Sequence[int], precision: str):
+    """Build the per-rate tables every job needs once per worker process rather than once per job."""
+    dtype = _precision_dtype(precision)
+    for fs in rates:
+        design_lowpass(fs)
+        PolyphaseBpskShaper(fs)
+        osc = OscillatorBank(fs, dtype=dtype)
+        osc.carrier([(PILOT_HZ, DEFAULT_PILOT_LEVEL)], 0, 1, phase=-np.pi / 2)
+        osc.carrier([(STEREO_SUBCARRIER_HZ, 1.0)], 0, 1)
+
+
+def _batch_run_job(kwargs: dict) -> Tuple[int, float]:
+    start = time.perf_counter()
+    frames = render_mpx_file(**kwargs)
+    return frames, time.perf_counter() - start
 
-    if input:
-        stereo, _ = read_audio_file(input, target_fs=fs)
+
+@cli.command()
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+@click.option("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+@click.option("--fs", type=int, default=192000, show_default=True, help="Sample rate for jobs that do not set fs")
+@click.option("--duration", type=float, default=30.0, show_default=True, help="Tone duration for jobs that do not set it (s)")
+@click.option("--precision", type=click.Choice(["32", "64"]), default="32", show_default=True,
+              help="Float width of the MPX signal path")
+@click.option("--chunk-seconds", type=float, default=1.0, show_default=True, help="Audio rendered and written per chunk (s)")
+@click.option("--logo-cache", type=click.Path(file_okay=False), default=None,
+              help="Directory to keep encoded logos in, shared by the workers and later runs")
+def batch(manifest: str, workers: Optional[int], fs: int, duration: float, precision: str, chunk_seconds: float,
+          logo_cache: Optional[str]):
+    """Render many MPX files in parallel from a CSV or JSON manifest.
+
+    Each job takes the tofile settings as columns/keys: output, input or tone, and optionally
+    duration, fs, pi, ps, rt, ptyn, af ("98.1,101.3"), ct, group_rates, pilot_level, rds_level, rds2,
+    rds2_level, logo, level_mpx, preemphasis, limiter, clipper. Relative
+    paths are taken from the manifest's directory. A failed job is reported and the rest carry on;
+    the exit status is 1 if any job failed.
+    """
+    if workers is not None and workers < 1:
+        raise click.UsageError("--workers must be at least 1")
+    if chunk_seconds <= 0:
+        raise click.UsageError("--chunk-seconds must be positive")
+    try:
+        raw_jobs = load_batch_manifest(manifest)
+    except (OSError, ValueError) as e:
+        raise click.UsageError(f"Cannot read manifest: {e}")
+
+    # Anything else a job leaves out takes render_mpx_file's (and so tofile's) defaults
+    defaults = dict(fs=fs, duration=duration, precision=precision, chunk_seconds=chunk_seconds, logo_cache=logo_cache)
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+
+    failed = 0
+    total_audio = 0.0
+    start = time.perf_counter()
+
+    def report_failure(label: str, error: BaseException):
+        nonlocal failed
+        failed += 1
+        click.echo(f"FAIL {label}: {error}", err=True)
+
+    jobs = []
+    for idx, raw in enumerate(raw_jobs, 1):
+        try:
+            jobs.append(_batch_job_kwargs(raw, defaults, base_dir))
+        except (ValueError, TypeError) as e:
+            report_failure(f"job {idx} ({raw.get('output', 'no output')})", e)
+
+    rates = sorted({job["fs"] for job in jobs})
+    with ProcessPoolExecutor(max_workers=workers, initializer=_batch_worker_init, initargs=(rates, precision)) as pool:
+        futures = {pool.submit(_batch_run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                frames, elapsed = future.result()
+            except Exception as e:
+                report_failure(job["output"], e)
+                continue
+            audio = frames / job["fs"]
+            total_audio += audio
+            click.echo(f"ok   {job['output']} ({audio:.2f}s at {job['fs']} Hz in {elapsed:.2f}s, "
+                       f"{audio / max(elapsed, 1e-9):.1f}x realtime)")
+
+    wall = max(time.perf_counter() - start, 1e-9)
+    click.echo(f"{len(raw_jobs) - failed}/{len(raw_jobs)} jobs rendered: {total_audio:.1f}s of MPX in {wall:.1f}s "
+               f"({total_audio / wall:.1f}x realtime overall)")
+    if failed:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument("url")
+@click.option("--fs", type=int, default=192000, show_default=True, help="MPX sample rate the sender uses")
+@click.option("--jitter-ms", type=float, default=50.0, show_default=True, help="Audio buffered before playout starts (ms)")
+@click.option("--device", type=int, default=None, help="Sounddevice output index")
+@click.option("--blocksize", type=int, default=1024, show_default=True, help="Output block size in frames")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Record to this WAV in real time instead of playing")
+@click.option("--duration", type=float, default=0.0, show_default=True, help="Stop after this many seconds (0 runs until Ctrl-C)")
+@click.option("--stats-interval", type=float, default=0.0, show_default=True,
+              help="Print receiver counters to stderr every N seconds (0 disables)")
+def receive(url: str, fs: int, jitter_ms: float, device: Optional[int], blocksize: int, output: Optional[str],
+            duration: float, stats_interval: float):
+    """Receive MPX sent by play --sink udp://HOST:PORT (or tcp://) and play it.
+
+    URL is the address to listen on, e.g. udp://0.0.0.0:9000.
+    """
+    proto, _, rest = url.partition("://")
+    host, _, port = rest.rpartition(":")
+    try:
+        receiver = MpxReceiver(proto, host or "0.0.0.0", int(port), fs, jitter_ms=jitter_ms).start()
+    except (ValueError, OSError) as e:
+        raise click.UsageError(f"Cannot listen on {url}: {e}")
+    click.echo(f"Listening on {proto}://{receiver.address[0]}:{receiver.address[1]}", err=True)
+
+    done = threading.Event()
+    stream = None
+    if output:
+        def pump():
+            block = np.zeros(blocksize, dtype=np.float32)
+            next_t = time.monotonic()
+            with sf.SoundFile(output, 'w', samplerate=fs, channels=1, subtype='PCM_24') as f:
+                while not done.is_set():
+                    receiver.read_into(block)
+                    f.write(block)
+                    next_t += blocksize / fs
+                    time.sleep(max(0.0, next_t - time.monotonic()))
+
+        pump_thread = threading.Thread(target=pump, daemon=True)
+        pump_thread.start()
     else:
-        stereo = generate_tone(duration_s=duration, fs=fs, freq_hz=tone or 1000.0)
+        stream = sd.OutputStream(device=device, channels=1, dtype='float32', samplerate=fs, blocksize=blocksize,
+                                 callback=receiver.callback)
+        stream.start()
+
+    start = time.monotonic()
+    next_report = start + stats_interval
+    try:
+        while not (duration > 0 and time.monotonic() - start >= duration):
+            time.sleep(0.1)
+            if stats_interval > 0 and time.monotonic() >= next_report:
+                next_report += stats_interval
+                click.echo(receiver.summary(), err=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        done.set()
+        if stream is not None:
+            stream.close()
+        else:
+            pump_thread.join()
+        receiver.close()
+    click.echo(receiver.summary())
 
-    total_seconds = stereo.shape[0] / fs
 
-    cfg = RdsConfig(pi_code=int(pi, 16), program_service_name=ps or "", radiotext=rt or "")
-    gen = RdsBitstreamGenerator(cfg)
+BENCH_STAGES = ("read", "processing", "lowpass", "oscillators", "groups", "groups_ref", "rds_bits", "bpsk_rds",
+                "bpsk_rds2", "engine", "make_mpx")
+# Stages timed per batch of RDS groups rather than per audio block, and the batch size: big
+# enough that the per-call overhead does not hide what the encoder costs per group
+_BENCH_GROUP_STAGES = ("groups", "groups_ref")
+_BENCH_GROUP_BATCH = 1024
 
-    if rds2 and logo:
-        gen.set_logo_bits(load_logo_bits(logo))
 
-    rds_bits = gen.generate_bits(int(math.ceil(total_seconds * RDS_BITRATE * 1.1)))
+def _encode_group_bitwise(words: np.ndarray) -> np.ndarray:
+    """Reference for encode_groups on one group: the original per-group path, a bit-serial
+    checkword per block and the bits appended one at a time. Kept for the bench comparison."""
+    bits: List[int] = []
+    for word, offset in zip(words.tolist(), _RDS_OFFSETS.tolist()):
+        checkword = _rds_crc10_bitwise(word) ^ offset
+        for i in range(15, -1, -1):
+            bits.append((word >> i) & 1)
+        for i in range(9, -1, -1):
+            bits.append((checkword >> i) & 1)
+    return np.array(bits, dtype=np.uint8)
 
-    mpx = make_mpx(
-        left=stereo[:, 0],
-        right=stereo[:, 1],
-        fs=fs,
-        pilot_level=pilot_level,
-        rds_level=rds_level,
-        rds2_level=rds2_level,
-        rds_bits=rds_bits,
-        enable_rds2=rds2,
-    )
-    mpx *= db_to_linear(level_mpx)
 
-    sf.write(output, mpx, samplerate=fs, subtype='PCM_24')
-    click.echo(f"Wrote {output} ({len(mpx)/fs:.2f}s at {fs} Hz)")
+def _bench_source(input: Optional[str], tone: float, fs: int, block_frames: int, duration: float) -> Iterator[np.ndarray]:
+    """duration seconds of stereo blocks at fs; a short input file is read again from the start until long enough."""
+    total = int(duration * fs)
+
+    def looped() -> Iterator[np.ndarray]:
+        produced = 0
+        while produced < total:
+            if input:
+                blocks = iter_audio_blocks(input, target_fs=fs, block_frames=block_frames)
+            else:
+                blocks = iter_tone_blocks(duration_s=duration, fs=fs, block_frames=block_frames, freq_hz=tone)
+            before = produced
+            for block in blocks:
+                block = block[:total - produced]
+                produced += len(block)
+                yield block
+                if produced >= total:
+                    return
+            if produced == before:
+                return
+
+    return _rechunk(looped(), block_frames)
+
+
+def _bench_time(make_work, fs: int, frames: int) -> dict:
+    """Time each step of make_work() one block at a time, then run it again under tracemalloc
+    for the peak of new allocations (kept out of the timed pass, which it would slow down)."""
+    latencies = []
+    work = make_work()
+    start = time.perf_counter()
+    while True:
+        t0 = time.perf_counter()
+        try:
+            next(work)
+        except StopIteration:
+            break
+        latencies.append(time.perf_counter() - t0)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    tracemalloc.start()
+    for _ in make_work():
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    lat_ms = np.array(latencies or [0.0]) * 1e3
+    return {
+        "blocks": len(latencies),
+        "audio_seconds": frames / fs,
+        "wall_seconds": elapsed,
+        "realtime_factor": frames / fs / elapsed,
+        "p50_ms": float(np.percentile(lat_ms, 50)),
+        "p99_ms": float(np.percentile(lat_ms, 99)),
+        "max_ms": float(lat_ms.max()),
+        "peak_mem_mb": peak / 2**20,
+    }
+
+
+def bench_stages(stages: Sequence[str], fs: int, block_frames: int, duration: float, input: Optional[str] = None,
+                 tone: float = 1000.0, dtype=np.float32) -> List[dict]:
+    """Time each pipeline stage block by block over the same source; one result dict per stage."""
+    cfg = RdsConfig(pi_code=0x1234, program_service_name="BENCH", radiotext="Benchmark radiotext")
+    # The group stages need no audio, so a long run of them does not hold its audio in memory
+    if any(stage not in _BENCH_GROUP_STAGES for stage in stages):
+        blocks = list(_bench_source(input, tone, fs, block_frames, duration))
+        frames = sum(len(b) for b in blocks)
+    else:
+        blocks, frames = [], int(duration * fs)
+
+    def read():
+        return _bench_source(input, tone, fs, block_frames, duration)
+
+    def processing():
+        preemphasis, limiter = PreEmphasisFilter(fs, 50.0), LookaheadLimiter(fs, 0.85)
+        clipper = CompositeClipper(0.85)
+        for b in blocks:
+            stereo = limiter.process(preemphasis.process(b))
+            yield clipper.process((0.5 * (stereo[:, 0] + stereo[:, 1])).astype(dtype))
+
+    def lowpass():
+        filt = StereoFirFilter(design_lowpass(fs), dtype=dtype)
+        for b in blocks:
+            yield filt.filter_pair(b[:, 0], b[:, 1])
+
+    def oscillators():
+        osc, n = OscillatorBank(fs, dtype=dtype), 0
+        rds_carriers = [(RDS0_HZ, DEFAULT_RDS_LEVEL)] + [(sc, DEFAULT_RDS2_LEVEL) for sc in RDS2_SUBCARRIER_HZ]
+        for b in blocks:
+            yield (osc.carrier([(PILOT_HZ, DEFAULT_PILOT_LEVEL)], n, len(b), phase=-np.pi / 2),
+                   osc.carrier([(STEREO_SUBCARRIER_HZ, 1.0)], n, len(b)),
+                   osc.carrier(rds_carriers, n, len(b)))
+            n += len(b)
+
+    # The group words of a run in batches of _BENCH_GROUP_BATCH, for encode_groups against the
+    # per-group reference
+    carousel_words = np.stack([group_0a_words(cfg, i) for i in range(4)] + [group_2a_words(cfg, i) for i in range(16)])
+    total_groups = math.ceil(frames * RDS_GROUP_RATE / fs)
+
+    def group_words():
+        for start in range(0, total_groups, _BENCH_GROUP_BATCH):
+            stop = min(start + _BENCH_GROUP_BATCH, total_groups)
+            yield carousel_words[np.arange(start, stop) % len(carousel_words)]
+
+    def groups():
+        for words in group_words():
+            yield encode_groups(words)
+
+    def groups_ref():
+        for words in group_words():
+            yield [_encode_group_bitwise(w) for w in words]
+
+    def rds_bits():
+        gen, n, sent = RdsBitstreamGenerator(cfg), 0, 0
+        bits_per_sample = Fraction(RDS_BITRATE) / fs
+        for b in blocks:
+            n += len(b)
+            due = math.floor(n * bits_per_sample)
+            yield gen.generate_bits(due - sent)
+            sent = due
+
+    def bpsk(carriers):
+        def run():
+            osc, n = OscillatorBank(fs, dtype=dtype), 0
+            streams = [(_RdsBasebandStream(RdsBitstreamGenerator(cfg), fs, dtype), [c]) for c in carriers]
+            for b in blocks:
+                yield [s.read(len(b)) * osc.carrier(c, n, len(b)) for s, c in streams]
+                n += len(b)
+        return run
+
+    def engine():
+        mpx = MpxEngine(fs, RdsBitstreamGenerator(cfg), enable_rds2=True, dtype=dtype)
+        for b in blocks:
+            yield mpx.process(b[:, 0], b[:, 1])
+
+    def one_shot():
+        stereo = np.concatenate(blocks) if blocks else np.zeros((0, 2), dtype=np.float32)
+        bits = RdsBitstreamGenerator(cfg).generate_bits(int(math.ceil(frames * RDS_BITRATE / fs)) + 8)
+        yield make_mpx(stereo[:, 0], stereo[:, 1], fs, rds_bits=bits, enable_rds2=True)
+
+    work = {
+        "read": read,
+        "processing": processing,
+        "lowpass": lowpass,
+        "oscillators": oscillators,
+        "groups": groups,
+        "groups_ref": groups_ref,
+        "rds_bits": rds_bits,
+        "bpsk_rds": bpsk([(RDS0_HZ, DEFAULT_RDS_LEVEL)]),
+        "bpsk_rds2": bpsk([(sc, DEFAULT_RDS2_LEVEL) for sc in RDS2_SUBCARRIER_HZ]),
+        "engine": engine,
+        "make_mpx": one_shot,
+    }
+    results = []
+    for stage in stages:
+        # A group stage's "block" is a batch of groups, with the air time of the batch as its budget
+        budget_ms = (1e3 * _BENCH_GROUP_BATCH / RDS_GROUP_RATE if stage in _BENCH_GROUP_STAGES
+                     else 1e3 * block_frames / fs)
+        results.append(dict(stage=stage, fs=fs, block_frames=block_frames, block_budget_ms=budget_ms,
+                            **_bench_time(work[stage], fs, frames)))
+    return results
 
 
-def load_logo_bits(path: str) -> np.ndarray:
-    """Load an image and pack as a simple framed monochrome bitstream for RDS2.
+@cli.command()
+@click.option("--input", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Audio file to read (looped to --duration); default is a synthetic tone")
+@click.option("--tone", type=float, default=1000.0, show_default=True, help="Tone frequency when no --input (Hz)")
+@click.option("--duration", type=float, default=10.0, show_default=True, help="Seconds of audio per run")
+@click.option("--fs", "fs_list", type=int, multiple=True, default=(192000,), show_default=True,
+              help="MPX sample rate; repeat to compare, e.g. --fs 192000 --fs 228000 --fs 240000")
+@click.option("--blocksize", "block_list", type=int, multiple=True, default=(4096,), show_default=True,
+              help="Block size in frames; repeat to compare")
+@click.option("--stage", "stage_list", type=click.Choice(BENCH_STAGES), multiple=True,
+              help="Stage to run; repeat to select several (default: all)")
+@click.option("--precision", type=click.Choice(["32", "64"]), default="32", show_default=True,
+              help="Float width of the MPX signal path")
+@click.option("--json", "json_path", type=click.Path(dir_okay=False, allow_dash=True), default=None,
+              help="Also write results as JSON to this path ('-' for stdout only)")
+def bench(input: Optional[str], tone: float, duration: float, fs_list: Tuple[int, ...], block_list: Tuple[int, ...],
+          stage_list: Tuple[str, ...], precision: str, json_path: Optional[str]):
+    """Measure per-stage throughput, block latency and memory, offline.
+
+    Throughput is seconds of audio per wall-clock second (x realtime); latencies are per block and
+    should stay well under the block budget. make_mpx renders the whole run in one call. groups
+    encodes the run's RDS groups with encode_groups in batches of 1024 (about 86 s of RDS each;
+    latencies and budget are per batch, and fs and blocksize do not matter), groups_ref the same
+    groups one at a time with the bit-serial checkword the encoder replaced.
+    """
+    if duration <= 0:
+        raise click.UsageError("--duration must be positive")
+    stages = stage_list or BENCH_STAGES
+    results = []
+    quiet = json_path == "-"
+    if not quiet:
+        click.echo(f"{'stage':<12}{'fs':>8}{'block':>7}{'x realtime':>12}{'p50 ms':>9}{'p99 ms':>9}"
+                   f"{'budget ms':>11}{'peak MB':>9}")
+    for fs in fs_list:
+        for block_frames in block_list:
+            for r in bench_stages(stages, fs, block_frames, duration, input=input, tone=tone,
+                                  dtype=_precision_dtype(precision)):
+                results.append(r)
+                if not quiet:
+                    click.echo(f"{r['stage']:<12}{fs:>8}{block_frames:>7}{r['realtime_factor']:>12.1f}"
+                               f"{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}{r['block_budget_ms']:>11.2f}"
+                               f"{r['peak_mem_mb']:>9.1f}")
+    if json_path:
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "scipy": scipy.__version__,
+                "precision": precision,
+                "duration": duration,
+                "source": input or f"tone:{tone:g}",
+            },
+            "results": results,
+        }
+        with click.open_file(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+
+# Encoded logo frames by content hash, shared by every generator in the process
+_LOGO_CACHE: dict = {}
+# Bump when the frame layout changes so stale on-disk entries are ignored
+_LOGO_FORMAT = b"jmpx-logo-1"
+
+
+def encode_logo_frame(img: Image.Image) -> np.ndarray:
+    """Encode an image as one logo frame for RDS2: a simple framed monochrome bitstream.
     Frame format (repeating):
     - 8 bits magic (0xA7)
     - 7 bits width (1..64)
     - 6 bits height (1..32)
     - 3 bits reserved (0)
+    - 16 bits simple checksum (sum of the packed payload bytes & 0xFFFF)
     - width*height bits, row-major, 1=white, 0=black
-    - 16 bits simple checksum (sum of payload bytes & 0xFFFF)
     This is not an ETSI RDS2 logo standard; it's a practical, receiver-agnostic payload carried on RDS2 BPSK.
     """
-    img = Image.open(path).convert('L')
+    img = img.convert('L')
     w = min(RDS2_LOGO_MAX_W, max(1, img.width))
     h = min(RDS2_LOGO_MAX_H, max(1, img.height))
     if img.width != w or img.height != h:
         img = img.resize((w, h), Image.LANCZOS)
-    arr = np.array(img)
+    arr = np.asarray(img)
     # Binarize with Otsu-like threshold (simple mean)
-    thr = float(arr.mean())
-    bits = (arr >= thr).astype(np.uint8)
-
-    # Header bits
-    header = []
-    def put(val: int, nbits: int):
-        for i in range(nbits - 1, -1, -1):
-            header.append((val >> i) & 1)
-
-    put(RDS2_LOGO_MAGIC, 8)
-    put(w, 7)
-    put(h, 6)
-    put(0, 3)
-
-    payload_bits = bits.flatten().tolist()
-
-    # Compute checksum over payload bytes
-    # Pack payload bits into bytes MSB-first
-    payload_bytes = []
-    acc = 0
-    cnt = 0
-    for b in payload_bits:
-        acc = (acc << 1) | b
-        cnt += 1
-        if cnt == 8:
-            payload_bytes.append(acc)
-            acc = 0
-            cnt = 0
-    if cnt != 0:
-        acc <<= (8 - cnt)
-        payload_bytes.append(acc)
-
-    checksum = sum(payload_bytes) & 0xFFFF
-    footer = []
-    put(checksum, 16)
-
-    all_bits = np.array(header + payload_bits + footer, dtype=np.uint8)
-    return all_bits
+    payload = (arr >= arr.mean()).astype(np.uint8).ravel()
+    checksum = int(np.packbits(payload).sum(dtype=np.int64)) & 0xFFFF
+    header = (RDS2_LOGO_MAGIC << 32) | (w << 25) | (h << 19) | checksum
+    header_bits = np.unpackbits(np.frombuffer(header.to_bytes(5, "big"), dtype=np.uint8))
+    return np.concatenate([header_bits, payload])
+
+
+def load_logo_bits(path: str, cache_dir: Optional[str] = None) -> np.ndarray:
+    """Load an image and encode it with encode_logo_frame, as a read-only bit array.
+
+    Frames are cached by a hash of the file's content, in memory and, if cache_dir is given, as
+    .npy files there, so airing the same logo again (or rotating through a set) skips decoding.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    key = hashlib.sha256(_LOGO_FORMAT + data).hexdigest()
+    bits = _LOGO_CACHE.get(key)
+    if bits is not None:
+        return bits
+    cached = os.path.join(cache_dir, f"logo-{key}.npy") if cache_dir else None
+    if cached and os.path.exists(cached):
+        try:
+            bits = np.load(cached)
+        except (OSError, ValueError):
+            bits = None
+    if bits is None:
+        bits = encode_logo_frame(Image.open(io.BytesIO(data)))
+        if cached:
+            # Write then rename, so a concurrent reader never sees a partial file. The cache is
+            # only an optimisation: failing to write it must not stop the logo going on air.
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(tmp, "wb") as f:
+                    np.save(f, bits, allow_pickle=False)
+                os.replace(tmp, cached)
+            except OSError:
+                pass
+    bits.setflags(write=False)
+    if len(_LOGO_CACHE) >= 64:
+        _LOGO_CACHE.clear()
+    _LOGO_CACHE[key] = bits
+    return bits
 
 
 if __name__ == "__main__":
@@ -1,23 +1,28 @@
 #!/usr/bin/env python3
-import io
 import os
 import threading
 import time
 from typing import Optional
 
-from flask import Flask, render_template_string, request, redirect, url_for, send_from_directory, jsonify
-import numpy as np
+from flask import Flask, Response, render_template_string, request, redirect, url_for, jsonify
 import sounddevice as sd
-import soundfile as sf
 
 from rds2_stream import (
     RdsConfig,
     RdsBitstreamGenerator,
-    make_mpx,
+    MpxEngine,
+    DeviceSink,
+    SinkFanout,
+    PipelineMetrics,
+    RDS2_SUBCARRIER_HZ,
+    build_rds2_carousel,
+    parse_rds_update,
+    rds_config_dict,
     read_audio_file,
     generate_tone,
-    db_to_linear,
-    RDS_BITRATE,
+    tone_period,
+    render_mpx_loop,
+    LoopedProgram,
 )
 
 TEMPLATE = """
@@ -67,6 +72,11 @@ TEMPLATE = """
             {% endfor %}
           </select>
         </div>
+        <div>
+          <label class="inline-flex items-center gap-2">
+            <input type="checkbox" name="loop_cache" /> Render the loop once and replay it (low CPU; renders live after an RDS update)
+          </label>
+        </div>
       </div>
 
       <div class="space-y-3 p-4 bg-white rounded shadow">
@@ -113,6 +123,7 @@ TEMPLATE = """
       <div class="md:col-span-2 flex items-center gap-3">
         <button class="bg-blue-600 hover:bg-blue-700 text-white px-4 py-2 rounded" type="submit">Start</button>
         <a class="bg-gray-200 hover:bg-gray-300 px-4 py-2 rounded" href="{{ url_for('stop') }}">Stop</a>
+        <button class="bg-emerald-600 hover:bg-emerald-700 text-white px-4 py-2 rounded" type="button" id="updateRds">Update RDS live</button>
         <span id="status" class="ml-2 text-sm"></span>
       </div>
     </form>
@@ -129,6 +140,13 @@ TEMPLATE = """
     }
     sourceRadios.forEach(r=>r.addEventListener('change', updateSource));
     updateSource();
+    document.getElementById('updateRds').addEventListener('click', async ()=>{
+      const f = document.querySelector('form');
+      const res = await fetch('{{ url_for('rds') }}', {method: 'POST', headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({pi: f.pi.value, ps: f.ps.value, rt: f.rt.value})});
+      const data = await res.json();
+      document.getElementById('status').textContent = data.ok ? 'RDS updated' : data.error;
+    });
   </script>
 </body>
 </html>
@@ -138,6 +156,10 @@ app = Flask(__name__)
 
 _stream_thread: Optional[threading.Thread] = None
 _stop_flag = threading.Event()
+# Metrics of the current (or last) stream, served at /metrics
+_metrics: Optional[PipelineMetrics] = None
+# RDS generator of the running stream, retuned live through /rds
+_gen: Optional[RdsBitstreamGenerator] = None
 
 
 def list_output_devices():
@@ -153,55 +175,67 @@ def list_output_devices():
 
 def run_stream(fs: int, device: Optional[int], audio_path: Optional[str], tone: Optional[float], duration: float,
                pi_hex: str, ps: str, rt: str, pilot_level: float, rds_level: float, rds2_level: float,
-               enable_rds2: bool, logo_path: Optional[str]):
+               enable_rds2: bool, logo_path: Optional[str], loop_cache: bool = False):
     sd.default.samplerate = fs
     if device is not None:
         sd.default.device = device
 
     if audio_path:
         stereo, _ = read_audio_file(audio_path, target_fs=fs)
+    elif loop_cache:
+        # The tone repeats exactly; one period is all the loop needs
+        stereo = tone_period(fs, tone or 1000.0)
     else:
         stereo = generate_tone(duration_s=duration, fs=fs, freq_hz=tone or 1000.0)
 
     cfg = RdsConfig(pi_code=int(pi_hex, 16), program_service_name=ps or '', radiotext=rt or '')
     gen = RdsBitstreamGenerator(cfg)
-    if enable_rds2 and logo_path:
-        from rds2_stream import load_logo_bits
-        gen.set_logo_bits(load_logo_bits(logo_path))
-
-    total_seconds = stereo.shape[0] / fs
-    rds_bits = gen.generate_bits(int(total_seconds * RDS_BITRATE * 1.1))
-
+    carousel = build_rds2_carousel(logo_path) if enable_rds2 else None
+
+    engine = MpxEngine(fs, gen, pilot_level=pilot_level, rds_level=rds_level, rds2_level=rds2_level,
+                       enable_rds2=enable_rds2,
+                       rds2_gens=[carousel.stream() for _ in RDS2_SUBCARRIER_HZ] if carousel else None)
+
+    # The source loops forever: optionally render one period once and replay it
+    loop = None
+    if loop_cache:
+        try:
+            loop = render_mpx_loop(engine, stereo, carousel=carousel.copy() if carousel else None)
+        except ValueError as e:
+            app.logger.warning('Loop cache off: %s', e)
+    program = LoopedProgram(stereo, engine, loop, carousel)
+
+    # Render on a producer thread into the device ring the callback only copies from
     blocksize = 4096
-    idx = 0
-    gain = 1.0
-
-    def callback(outdata, frames, time_info, status):
-        nonlocal idx, rds_bits
-        if _stop_flag.is_set():
-            raise sd.CallbackStop
-        end = min(idx + frames, stereo.shape[0])
-        left = stereo[idx:end, 0]
-        right = stereo[idx:end, 1]
-        bits_needed = int((end - idx) / fs * RDS_BITRATE) + 208
-        if len(rds_bits) < bits_needed:
-            extra = gen.generate_bits(int(2.0 * RDS_BITRATE))
-            rds_bits = np.concatenate([rds_bits, extra])
-        bits_block = rds_bits[:bits_needed]
-        rds_bits = rds_bits[bits_needed:]
-        mpx = make_mpx(left, right, fs, pilot_level, rds_level, rds2_level, bits_block, enable_rds2)
-        if outdata.shape[1] == 1:
-            outdata[:, 0] = mpx
-        else:
-            outdata[:, 0] = mpx
-            outdata[:, 1] = mpx
-        idx = end
-        if idx >= stereo.shape[0]:
-            idx = 0  # loop audio for continuous streaming
-
-    with sd.OutputStream(channels=1, dtype='float32', callback=callback, blocksize=blocksize):
-        while not _stop_flag.is_set():
-            time.sleep(0.1)
+    lookahead_frames = int(0.2 * fs)
+    fanout = SinkFanout([DeviceSink(fs, blocksize, lookahead_frames)], fs, lookahead_frames, stop=_stop_flag)
+    ring = fanout.ring
+    metrics = PipelineMetrics(fs, engine=engine, ring=ring, gen=gen, sinks=fanout.sinks, carousel=carousel)
+    global _metrics, _gen
+    _metrics = metrics
+    _gen = gen
+
+    def producer():
+        try:
+            while not _stop_flag.is_set():
+                # Loop audio for continuous streaming, wrapping inside the block if needed
+                t0 = time.perf_counter()
+                mpx = program.read(blocksize)
+                metrics.observe_block(time.perf_counter() - t0, mpx)
+                fanout.write(mpx)
+        finally:
+            fanout.close()
+
+    producer_thread = threading.Thread(target=producer, daemon=True)
+    producer_thread.start()
+    try:
+        fanout.start()
+        fanout.wait()
+    finally:
+        # The device may have stopped by itself: end the producer before another stream can start
+        _stop_flag.set()
+        producer_thread.join()
+        fanout.stop()
 
 
 @app.route('/')
@@ -255,13 +289,40 @@ def start():
     _stream_thread = threading.Thread(target=run_stream, kwargs=dict(
         fs=fs, device=device, audio_path=audio_path, tone=tone, duration=duration,
         pi_hex=pi_hex, ps=ps, rt=rt, pilot_level=pilot, rds_level=rds, rds2_level=rds2,
-        enable_rds2=enable_rds2, logo_path=logo_path
+        enable_rds2=enable_rds2, logo_path=logo_path, loop_cache=request.form.get('loop_cache') == 'on'
     ), daemon=True)
     _stream_thread.start()
 
     return redirect(url_for('index'))
 
 
+@app.get('/metrics')
+def metrics():
+    """Pipeline metrics in Prometheus text format, or JSON with ?format=json or Accept: application/json."""
+    m = _metrics
+    want_json = request.args.get('format') == 'json' or \
+        request.accept_mimetypes.best_match(['text/plain', 'application/json']) == 'application/json'
+    if want_json:
+        return jsonify(dict(m.snapshot(), running=bool(_stream_thread and _stream_thread.is_alive())) if m else {})
+    return Response(m.prometheus() if m else '', mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/rds', methods=['GET', 'POST'])
+def rds():
+    """Read or change the live RDS settings: POST {"pi", "pty", "tp", "ps", "rt"} (any subset) as JSON.
+    The change goes on air at the next group boundary without touching the audio stream."""
+    gen = _gen
+    if gen is None or not (_stream_thread and _stream_thread.is_alive()):
+        return jsonify({'ok': False, 'error': 'not streaming'}), 409
+    if request.method == 'GET':
+        return jsonify({'ok': True, 'config': rds_config_dict(gen.latest_config())})
+    try:
+        cfg = gen.update_config(**parse_rds_update(request.get_json(force=True, silent=True)))
+    except ValueError as e:
+        return jsonify({'ok': False, 'error': str(e)}), 400
+    return jsonify({'ok': True, 'config': rds_config_dict(cfg)})
+
+
 @app.get('/stop')
 def stop():
     _stop_flag.set()